@@ -0,0 +1,64 @@
+import numpy as np
+
+
+def _check_out(img, out = None, inplace = False, shape = None):
+    '''Validates 'out' and 'inplace' arguments and returns the array
+    the result has to be written into, or None if a new array has to
+    be allocated. 'shape' is the shape of the result, it defaults to
+    the shape of the passed image.'''
+    
+    assert type(inplace) == bool, "Argument 'inplace' can only be True or False."
+    
+    assert not (inplace == True and out is not None), "Arguments 'out' and 'inplace' can not be used together."
+    
+    shape = img.shape if shape is None else tuple(shape)
+    
+    if inplace == True:
+        assert shape == img.shape, "Argument 'inplace' can only be True when the output has the same shape as the passed image."
+
+        assert img.flags.c_contiguous and img.flags.writeable, "Argument 'inplace' can only be True for a writeable C-contiguous image."
+
+        return img
+    
+    if out is not None:
+        assert (type(out) == np.ndarray and out.shape == shape and out.dtype == img.dtype), "Argument 'out' must be a numpy.ndarray of shape {} and type {}.".format(shape, img.dtype)
+        
+        assert out.flags.c_contiguous and out.flags.writeable, "Argument 'out' must be a writeable C-contiguous array."
+    
+    return out
+
+
+def _out_shape(img, dsize):
+    '''Returns shape of the output image of size (w, h) with
+    the same number of channels as the passed image.'''
+    
+    return (dsize[1], dsize[0]) + img.shape[2:]
+
+
+def _copy_into(img, out):
+    '''Returns a copy of the image, written into 'out' array if
+    passed. Nothing is copied if 'out' is the image itself.'''
+    
+    if out is None:
+        return img.copy()
+    
+    if out is not img:
+        out[...] = img
+    
+    return out
+
+
+def _get_rng(rng):
+    '''Returns a numpy.random.Generator. If 'rng' is None, a generator
+    is seeded from the global numpy random state, so 'np.random.seed'
+    still gives reproducible results.'''
+    
+    if rng is None:
+        return np.random.default_rng(np.random.randint(2**32, dtype = np.uint64))
+    
+    if type(rng) == int:
+        return np.random.default_rng(rng)
+    
+    assert isinstance(rng, np.random.Generator), "Argument 'rng' must be None, an int seed or a numpy.random.Generator."
+    
+    return rng
@@ -0,0 +1,628 @@
+'''Batched versions of the augmentation functions for arrays of shape
+(N, h, w, c), e.g. many small crops.
+
+Arguments are validated once per batch instead of once per image and the
+result is written into one preallocated output batch. Parameters can be
+a single value shared by the whole batch or an array with one value per
+image. Lookup tables, noise and random rectangles are computed for all
+images at once with numpy, while warps and filters run per image in a
+tight loop writing straight into the output batch.
+
+Boxes of a batch are passed as one ragged array - all boxes concatenated
+into an array of shape (M, 4) and 'offsets' of shape (N + 1,), where the
+boxes of image i are boxes[offsets[i] : offsets[i + 1]]. 'pack_boxes' and
+'split_boxes' convert between this format and a list of arrays.
+
+Example:
+    boxes, offsets = pack_boxes([boxes_0, boxes_1, ...])
+    imgs_new, boxes_new, degenerate = rotate(imgs, angle = rng.uniform(-15, 15, len(imgs)), boxes = boxes, offsets = offsets)
+    imgs_new = brightness_contrast(imgs_new, alpha = rng.uniform(0.8, 1.2, len(imgs)), beta = 10)
+'''
+
+import cv2
+import numpy as np
+
+from ._common import _check_out, _copy_into, _get_rng
+from .geometric import _clip_boxes, _scale_matrix
+from .photometric import NoiseBank, _lut
+from .profiling import instrument
+
+
+# Number of float32 values of noise computed at once by 'addNoise'.
+_NOISE_CHUNK = 2**18
+
+
+def pack_boxes(boxes_list):
+    '''Returns (boxes, offsets) - the boxes of all images concatenated
+    into an array of shape (M, 4) and the offsets of every image.'''
+
+    counts = [len(boxes) for boxes in boxes_list]
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    if sum(counts) == 0:
+        return np.zeros((0, 4)), offsets
+    return np.concatenate([np.asarray(boxes, dtype = np.float64).reshape(-1, 4) for boxes in boxes_list]), offsets
+
+
+def _standard_normal(rng, out):
+    '''Fills the float32 array 'out' with standard normal values using the
+    Box-Muller transform. Two uniform draws and vectorized log, sqrt, cos
+    and sin are faster than the float32 ziggurat of 'standard_normal'.'''
+
+    flat = out.reshape(-1)
+    half = (flat.size + 1) // 2
+    rest = flat.size - half
+
+    u = rng.random((2, half), dtype = np.float32)
+    radius = np.log1p(-u[0])
+    radius *= -2
+    np.sqrt(radius, out = radius)
+    angle = u[1]
+    angle *= np.float32(2 * np.pi)
+
+    np.cos(angle, out = flat[:half])
+    flat[:half] *= radius
+    np.sin(angle[:rest], out = flat[half:])
+    flat[half:] *= radius[:rest]
+    return out
+
+
+def split_boxes(boxes, offsets):
+    '''Returns the list of per-image box arrays of a ragged batch of boxes.'''
+
+    return np.split(boxes, offsets[1:-1])
+
+
+def _check_batch(imgs):
+    assert type(imgs) == np.ndarray and imgs.ndim == 4 and imgs.dtype == np.uint8, "Argument 'imgs' must be a numpy.ndarray of type uint8 and shape (N, h, w, c)."
+
+
+def _param(value, n, name):
+    '''Returns a shared or per-image parameter as a float64 array of length n.'''
+
+    values = np.asarray(value, dtype = np.float64)
+
+    assert values.ndim == 0 or values.shape == (n,), "Argument '{}' must be a number or an array with one value per image ({}).".format(name, n)
+
+    return np.broadcast_to(values, (n,))
+
+
+def _image(batch, i):
+    '''Returns image i of a batch in the 2D or 3D form OpenCV expects.'''
+
+    return batch[i, :, :, 0] if batch.shape[3] == 1 else batch[i]
+
+
+def _tables(op, values):
+    '''Returns the lookup tables of a pointwise operation, one row per
+    image. Tables come from the cache of the single-image functions and
+    are built once for every distinct value.'''
+
+    unique, inverse = np.unique(values, return_inverse = True)
+    tables = np.stack([_lut(op, value.item()) for value in unique])
+    return tables if len(unique) == 1 else tables[inverse]
+
+
+def _lookup(imgs, tables, out, inplace):
+    '''Applies one uint8 lookup table per image, or a single table of
+    shape (1, 256) to the whole batch with one cv2.LUT call.'''
+
+    out = _check_out(imgs, out, inplace)
+    imgs_new = np.empty(imgs.shape, dtype = np.uint8) if out is None else out
+
+    if len(tables) == 1:
+        cv2.LUT(imgs.reshape(-1, imgs.shape[3]), tables[0], dst = imgs_new.reshape(-1, imgs.shape[3]))
+        return imgs_new
+
+    # Applying the tables image by image with cv2.LUT is faster than a
+    # numpy gather over the whole batch, which needs an index per pixel.
+    # The lookup itself is most of the work, so the loop is kept lean.
+    if imgs.shape[3] == 1:
+        imgs, imgs_new_view = imgs[..., 0], imgs_new[..., 0]
+    else:
+        imgs_new_view = imgs_new
+    for img, table, img_new in zip(imgs, tables, imgs_new_view):
+        cv2.LUT(img, table, img_new)
+
+    return imgs_new
+
+
+def _check_ragged(boxes, offsets, n):
+    assert (type(boxes) == np.ndarray and boxes.ndim == 2 and boxes.shape[1] == 4), "Argument 'boxes' must be a numpy.ndarray of shape (M, 4)."
+
+    assert (offsets is not None and len(offsets) == n + 1 and offsets[0] == 0 and offsets[-1] == len(boxes)), "Argument 'offsets' must have N + 1 values, from 0 to the number of boxes."
+
+
+def _warp_boxes(M, boxes, offsets):
+    '''Maps the corners of all boxes through the 2x3 matrix of their
+    image with a single batched matrix multiply and returns the
+    axis-aligned boxes enclosing the transformed corners.'''
+
+    index = np.repeat(np.arange(len(M)), np.diff(offsets))
+    corners = boxes[:, [0, 1, 0, 3, 2, 3, 2, 1]].reshape(-1, 4, 2)
+    Ms = M[index]
+    corners = corners @ Ms[:, :, :2].transpose(0, 2, 1) + Ms[:, None, :, 2]
+    return np.concatenate([corners.min(axis = 1), corners.max(axis = 1)], axis = 1)
+
+
+def _affine(imgs, M, dsize, boxes, offsets, out, inplace, border = cv2.BORDER_CONSTANT):
+    '''Warps every image with its own 2x3 matrix into one output batch.'''
+
+    if boxes is not None:
+        _check_ragged(boxes, offsets, len(imgs))
+
+    out = _check_out(imgs, out, inplace, (len(imgs), dsize[1], dsize[0], imgs.shape[3]))
+    imgs_new = np.empty((len(imgs), dsize[1], dsize[0], imgs.shape[3]), dtype = np.uint8) if out is None else out
+
+    for i in range(len(imgs)):
+        cv2.warpAffine(_image(imgs, i), M[i], dsize, dst = _image(imgs_new, i), borderMode = border)
+
+    if boxes is None:
+        return imgs_new
+
+    boxes_new, degenerate = _clip_boxes(_warp_boxes(M, boxes, offsets), imgs_new.shape[1:])
+    return imgs_new, boxes_new, degenerate
+
+
+@instrument
+def rotate(imgs, angle, boxes = None, offsets = None, out = None, inplace = False):
+    '''Rotates every image about its centre by its 'angle', keeping the
+    resolution. 'angle' is a number or an array with one angle per image.
+    If ragged boxes are passed, returns (imgs, boxes, degenerate).'''
+
+    _check_batch(imgs)
+    n, h, w = imgs.shape[:3]
+    angle = np.deg2rad(_param(angle, n, 'angle'))
+
+    # Same matrices as 'cv2.getRotationMatrix2D', for all images at once.
+    cos, sin = np.cos(angle), np.sin(angle)
+    cx, cy = w / 2, h / 2
+    M = np.stack([np.stack([cos, sin, (1 - cos) * cx - sin * cy], axis = 1),
+                  np.stack([-sin, cos, sin * cx + (1 - cos) * cy], axis = 1)], axis = 1)
+
+    return _affine(imgs, M, (w, h), boxes, offsets, out, inplace)
+
+
+@instrument
+def shear(imgs, shear_val, axis = 0, boxes = None, offsets = None, out = None, inplace = False):
+    '''Shears every image along 'axis' by its 'shear_val', a number or an
+    array with one value per image. If ragged boxes are passed, returns
+    (imgs, boxes, degenerate).'''
+
+    assert (axis == 0 or axis == 1), "Value of argument 'axis' must be either 0 or 1."
+
+    _check_batch(imgs)
+    n, h, w = imgs.shape[:3]
+    M = np.zeros((n, 2, 3))
+    M[:, 0, 0] = M[:, 1, 1] = 1
+    M[:, axis, 1 - axis] = _param(shear_val, n, 'shear_val')
+
+    return _affine(imgs, M, (w, h), boxes, offsets, out, inplace)
+
+
+@instrument
+def translate(imgs, tx, ty, boxes = None, offsets = None, out = None, inplace = False):
+    '''Translates every image by its 'tx' and 'ty', numbers or arrays with
+    one value per image. If ragged boxes are passed, returns (imgs,
+    boxes, degenerate).'''
+
+    _check_batch(imgs)
+    n, h, w = imgs.shape[:3]
+    M = np.zeros((n, 2, 3))
+    M[:, 0, 0] = M[:, 1, 1] = 1
+    M[:, 0, 2] = _param(tx, n, 'tx')
+    M[:, 1, 2] = _param(ty, n, 'ty')
+
+    return _affine(imgs, M, (w, h), boxes, offsets, out, inplace)
+
+
+@instrument
+def scale(imgs, fx, fy, keep_resolution = False, boxes = None, offsets = None, out = None, inplace = False):
+    '''Scales every image by 'fx' and 'fy'. Without keep_resolution all
+    images get the same output size, so 'fx' and 'fy' must be numbers.
+    With keep_resolution they can be arrays with one value >= 1 per
+    image and the centre of every scaled image is kept, as in 'scale'.
+    If ragged boxes are passed, returns (imgs, boxes, degenerate).'''
+
+    _check_batch(imgs)
+    n, h, w = imgs.shape[:3]
+    fx, fy = _param(fx, n, 'fx'), _param(fy, n, 'fy')
+
+    assert np.all(fx > 0) and np.all(fy > 0), "Arguments 'fx' and 'fy' must be greater than 0"
+
+    if keep_resolution == True:
+        assert np.all(fx >= 1) and np.all(fy >= 1), "'keep_resolution' can only be True when fx,fy >= 1."
+
+        M_boxes = np.stack([_scale_matrix(imgs.shape[1:], float(fx[i]), float(fy[i]), True)[0] for i in range(n)])
+        M = M_boxes.copy()
+        M[:, 0, 2] += 0.5 * fx - 0.5
+        M[:, 1, 2] += 0.5 * fy - 0.5
+        imgs_new = _affine(imgs, M, (w, h), None, None, out, inplace, cv2.BORDER_REPLICATE)
+
+        if boxes is None:
+            return imgs_new
+
+        # Boxes enclosing the whole kept centre cover the full output.
+        _check_ragged(boxes, offsets, n)
+        boxes_new = _warp_boxes(M_boxes, boxes, offsets)
+        inside = (boxes_new[:, 0] <= 0) & (boxes_new[:, 2] >= w) & (boxes_new[:, 1] <= 0) & (boxes_new[:, 3] >= h)
+        boxes_new, degenerate = _clip_boxes(boxes_new, imgs_new.shape[1:])
+        boxes_new[inside] = [0, 0, w, h]
+        degenerate[inside] = False
+        return imgs_new, boxes_new, degenerate
+
+    assert np.all(fx == fx[0]) and np.all(fy == fy[0]), "Arguments 'fx' and 'fy' must be the same for the whole batch when 'keep_resolution' is False."
+
+    M, dsize = _scale_matrix(imgs.shape[1:], float(fx[0]), float(fy[0]))
+    out = _check_out(imgs, out, inplace, (n, dsize[1], dsize[0], imgs.shape[3]))
+    imgs_new = np.empty((n, dsize[1], dsize[0], imgs.shape[3]), dtype = np.uint8) if out is None else out
+
+    for i in range(n):
+        cv2.resize(_image(imgs, i), dsize, dst = _image(imgs_new, i))
+
+    if boxes is None:
+        return imgs_new
+
+    _check_ragged(boxes, offsets, n)
+    # Scaled boxes are not clamped, degenerate boxes can not occur.
+    boxes_new = _warp_boxes(np.broadcast_to(M, (n, 2, 3)), boxes, offsets)
+    return imgs_new, boxes_new, np.zeros(len(boxes_new), dtype = bool)
+
+
+@instrument
+def crop(imgs, point1, point2, boxes = None, offsets = None, out = None):
+    '''Crops every image from point1 to point2, the window is shared by
+    the whole batch and copied with one slice. If ragged boxes are
+    passed, returns (imgs, boxes, degenerate).'''
+
+    assert ((type(point1) == tuple and len(point1) == 2) and (type(point2) == tuple and len(point2) == 2)), "'point1' and 'point2' must be of type tuple and must have a lenght of two."
+
+    _check_batch(imgs)
+    n, h, w = imgs.shape[:3]
+
+    assert (point1[0] >= 0 and point2[0] < w) and (point1[1] >= 0 and point2[1] < h), "'point1' and 'point2' must not exceed image dimensions."
+
+    assert (point2[0] > point1[0]) and (point2[1] > point1[1]), "'point2' must be greater than 'point1'."
+
+    (x1, y1), (x2, y2) = point1, point2
+    out = _check_out(imgs, out, shape = (n, y2 - y1, x2 - x1, imgs.shape[3]))
+    imgs_new = np.empty((n, y2 - y1, x2 - x1, imgs.shape[3]), dtype = np.uint8) if out is None else out
+    imgs_new[...] = imgs[:, y1:y2, x1:x2]
+
+    if boxes is None:
+        return imgs_new
+
+    _check_ragged(boxes, offsets, n)
+    boxes_new, degenerate = _clip_boxes(boxes - [x1, y1, x1, y1], imgs_new.shape[1:])
+
+    # Boxes enclosing the whole crop window cover the full output.
+    inside = (boxes[:, 0] <= x1) & (boxes[:, 2] >= x2) & (boxes[:, 1] <= y1) & (boxes[:, 3] >= y2)
+    boxes_new[inside] = [0, 0, x2 - x1, y2 - y1]
+    degenerate[inside] = False
+    return imgs_new, boxes_new, degenerate
+
+
+@instrument
+def random_resized_crop(imgs, size, scale = (0.08, 1.0), ratio = (3/4, 4/3), boxes = None, offsets = None, rng = None, out = None):
+    '''Crops a random region of every image and resizes it to 'size'
+    (w, h), with the sampling of 'random_resized_crop'. The regions of
+    all images are drawn at once, every image is resized straight into
+    the output batch. If ragged boxes are passed, returns (imgs, boxes,
+    degenerate).'''
+
+    assert (type(size) == tuple and len(size) == 2 and type(size[0]) == int and type(size[1]) == int and size[0] > 0 and size[1] > 0), "Argument 'size' must be of type tuple with two positive int values - (w, h)."
+
+    assert (type(scale) == tuple and len(scale) == 2 and 0 < scale[0] <= scale[1] <= 1), "Argument 'scale' must be of type tuple with two values - (min, max), where 0 < min <= max <= 1."
+
+    assert (type(ratio) == tuple and len(ratio) == 2 and 0 < ratio[0] <= ratio[1]), "Argument 'ratio' must be of type tuple with two positive values - (min, max), where min <= max."
+
+    _check_batch(imgs)
+    n, h, w = imgs.shape[:3]
+    rng = _get_rng(rng)
+    out = _check_out(imgs, out, shape = (n, size[1], size[0], imgs.shape[3]))
+    imgs_new = np.empty((n, size[1], size[0], imgs.shape[3]), dtype = np.uint8) if out is None else out
+
+    # Ten attempts for every image at once, the first one which fits is
+    # used. Images without one get the largest centre crop with the
+    # aspect ratio clamped to 'ratio'.
+    area = h * w * rng.uniform(scale[0], scale[1], (n, 10))
+    aspect = np.exp(rng.uniform(np.log(ratio[0]), np.log(ratio[1]), (n, 10)))
+    cw, ch = np.rint(np.sqrt(area * aspect)).astype(np.int64), np.rint(np.sqrt(area / aspect)).astype(np.int64)
+    fits = (cw > 0) & (cw <= w) & (ch > 0) & (ch <= h)
+    first = fits.argmax(axis = 1)
+    cw, ch = cw[np.arange(n), first], ch[np.arange(n), first]
+
+    if w / h < ratio[0]:
+        fallback = w, int(round(w / ratio[0]))
+    elif w / h > ratio[1]:
+        fallback = int(round(h * ratio[1])), h
+    else:
+        fallback = w, h
+    found = fits.any(axis = 1)
+    cw, ch = np.where(found, cw, fallback[0]), np.where(found, ch, fallback[1])
+    x1 = np.where(found, rng.integers(0, w - cw + 1), (w - cw) // 2)
+    y1 = np.where(found, rng.integers(0, h - ch + 1), (h - ch) // 2)
+
+    fx, fy = size[0] / cw, size[1] / ch
+    for i, (x, y, cwi, chi) in enumerate(zip(x1.tolist(), y1.tolist(), cw.tolist(), ch.tolist())):
+        interpolation = cv2.INTER_AREA if (fx[i] < 1 and fy[i] < 1) else cv2.INTER_LINEAR
+        cv2.resize(_image(imgs, i)[y : y + chi, x : x + cwi], size, dst = _image(imgs_new, i), interpolation = interpolation)
+
+    if boxes is None:
+        return imgs_new
+
+    _check_ragged(boxes, offsets, n)
+    index = np.repeat(np.arange(n), np.diff(offsets))
+    shift = np.stack([x1, y1, x1, y1], axis = 1)[index]
+    factor = np.stack([fx, fy, fx, fy], axis = 1)[index]
+    boxes_new, degenerate = _clip_boxes((boxes - shift) * factor, imgs_new.shape[1:])
+    return imgs_new, boxes_new, degenerate
+
+
+@instrument
+def blur(imgs, blur_type = 'avg', ksize = (5, 5), median_ksize = 5, gaussian_sigma = 0, out = None, inplace = False):
+    '''Blurs every image of the batch. Arguments are same as 'blur'
+    and shared by the whole batch.'''
+
+    assert blur_type in ['avg', 'gaussian', 'median'], "Argument 'blur_type' can only have one of these three vales - 'avg', 'gaussian', 'median'."
+
+    assert type(ksize) == tuple and len(ksize) == 2 and (ksize[0] > 0 and ksize[0] % 2 != 0) and (ksize[1] > 0 and ksize[1] % 2 != 0), "Argument 'ksize' can only be of type tuple with length equal to two and 'ksize' values must be odd positive integers."
+
+    assert type(median_ksize) == int and median_ksize > 0 and median_ksize % 2 != 0, "Argument 'median_ksize' can only be of type int and must be an odd positive integer."
+
+    _check_batch(imgs)
+    out = _check_out(imgs, out, inplace)
+    imgs_new = np.empty_like(imgs) if out is None else out
+
+    for i in range(len(imgs)):
+        src, dst = _image(imgs, i), _image(imgs_new, i)
+        if blur_type == 'avg':
+            cv2.blur(src, ksize, dst = dst)
+        elif blur_type == 'gaussian':
+            cv2.GaussianBlur(src, ksize, gaussian_sigma, dst = dst)
+        else:
+            cv2.medianBlur(src, median_ksize, dst = dst)
+
+    return imgs_new
+
+
+@instrument
+def sharpen(imgs, out = None, inplace = False):
+    '''Sharpens every image of the batch with the kernel of 'sharpen'.'''
+
+    _check_batch(imgs)
+    out = _check_out(imgs, out, inplace)
+    imgs_new = np.empty_like(imgs) if out is None else out
+
+    kernel = np.array([[-1, -1, -1],
+                       [-1, 9, -1],
+                       [-1, -1, -1]])
+    for i in range(len(imgs)):
+        cv2.filter2D(_image(imgs, i), -1, kernel, dst = _image(imgs_new, i))
+
+    return imgs_new
+
+
+@instrument
+def brightness_contrast(imgs, alpha = 1.5, beta = 0, out = None, inplace = False):
+    '''Changes brightness and contrast of every image with its 'alpha' and
+    'beta', numbers or arrays with one value per image. The lookup tables
+    of all images are built in one numpy operation. Shared values are
+    applied to the whole batch with a single table.'''
+
+    _check_batch(imgs)
+    n = len(imgs)
+    alpha, beta = _param(alpha, n, 'alpha'), _param(beta, n, 'beta')
+
+    assert np.all(alpha >= 0), "Argument 'alpha' must be greater than or equal to 0."
+
+    if np.all(alpha == alpha[0]) and np.all(beta == beta[0]):
+        return _lookup(imgs, _lut('brightness_contrast', float(alpha[0]), float(beta[0]))[None], out, inplace)
+
+    # Same tables as 'brightness_contrast', one row per image, computed
+    # in place.
+    tables = np.multiply.outer(alpha, np.arange(256, dtype = np.float64))
+    tables += beta[:, None]
+    tables = np.clip(tables, 0, 255, out = tables).astype(np.uint8)
+
+    return _lookup(imgs, tables, out, inplace)
+
+
+@instrument
+def gamma(imgs, gamma_val = 1.0, out = None, inplace = False):
+    '''Applies gamma correction to every image with its 'gamma_val', a
+    number or an array with one value per image.'''
+
+    _check_batch(imgs)
+    gamma_val = _param(gamma_val, len(imgs), 'gamma_val')
+
+    assert np.all(gamma_val > 0), "Argument 'gamma_val' must be greater than 0."
+
+    return _lookup(imgs, _tables('gamma', gamma_val), out, inplace)
+
+
+@instrument
+def invert(imgs, out = None, inplace = False):
+    '''Returns the negative of every image of the batch.'''
+
+    _check_batch(imgs)
+
+    return _lookup(imgs, _lut('invert')[None], out, inplace)
+
+
+@instrument
+def posterize(imgs, bits = 4, out = None, inplace = False):
+    '''Reduces every channel of every image to its number of 'bits', an
+    int or an array with one value per image.'''
+
+    _check_batch(imgs)
+    bits = _param(bits, len(imgs), 'bits')
+
+    assert np.all(bits == np.round(bits)) and np.all(bits >= 1) and np.all(bits <= 8), "Argument 'bits' must be an int between 1 and 8."
+
+    return _lookup(imgs, _tables('posterize', bits.astype(np.int64)), out, inplace)
+
+
+@instrument
+def colorSpace(imgs, colorspace = 'hsv', out = None, inplace = False):
+    '''Converts every BGR image of the batch to 'colorspace'. The
+    conversion works per pixel, so the whole batch is converted with
+    one call.'''
+
+    assert colorspace in (['hsv', 'ycrcb', 'lab']), "Wrong choice of argument 'colorspace'. Argument 'colorspace' can only be one of the following types - 'hsv', 'ycrcb' 'lab'."
+
+    _check_batch(imgs)
+
+    assert imgs.shape[3] == 3, "Images must have three channels (BGR)."
+
+    out = _check_out(imgs, out, inplace)
+    imgs_new = np.empty(imgs.shape, dtype = np.uint8) if out is None else out
+
+    code = {'hsv': cv2.COLOR_BGR2HSV, 'ycrcb': cv2.COLOR_BGR2YCrCb, 'lab': cv2.COLOR_BGR2Lab}[colorspace]
+    cv2.cvtColor(imgs.reshape(-1, imgs.shape[2], 3), code, dst = imgs_new.reshape(-1, imgs.shape[2], 3))
+
+    return imgs_new
+
+
+@instrument
+def addNoise(imgs, noise_type = 'gaussian', mean = 0, var = 0.05, sp_ratio = 0.5, noise_amount = 0.02, rng = None, noise_bank = None, out = None, inplace = False):
+    '''Adds noise to every image of the batch. 'mean', 'var', 'sp_ratio'
+    and 'noise_amount' are numbers or arrays with one value per image.
+    Gaussian noise can be served from a precomputed 'noise_bank'. With
+    salt_pepper noise, every pixel is salt with probability
+    noise_amount * sp_ratio and pepper with probability
+    noise_amount * (1 - sp_ratio).'''
+
+    assert noise_type in ['gaussian', 'salt_pepper', 'poisson'], "Wrong choice of argument 'noise_type'. Argument 'noise_type' can only be one of the following types - 'gaussian', 'salt_pepper' 'poisson'."
+
+    assert noise_bank is None or (isinstance(noise_bank, NoiseBank) and noise_type == 'gaussian'), "Argument 'noise_bank' must be a NoiseBank and can only be used with noise_type = 'gaussian'."
+
+    _check_batch(imgs)
+    n = len(imgs)
+    out = _check_out(imgs, out, inplace)
+    rng = _get_rng(rng)
+    expand = lambda values: values.astype(np.float32)[:, None, None, None]
+
+    if noise_type == 'salt_pepper':
+        amount, ratio = _param(noise_amount, n, 'noise_amount'), _param(sp_ratio, n, 'sp_ratio')
+        u = rng.random(imgs.shape[:3], dtype = np.float32)[..., None]
+        salt = u < expand(amount * ratio)
+        pepper = (u < expand(amount)) & ~salt
+
+        imgs_new = _copy_into(imgs, out)
+        np.copyto(imgs_new, 255, where = salt)
+        np.copyto(imgs_new, 0, where = pepper)
+        return imgs_new
+
+    if noise_type == 'gaussian':
+        var = _param(var, n, 'var')
+        mean = _param(mean, n, 'mean')
+
+        assert np.all(var >= 0), "Argument 'var' must be greater than or equal to zero."
+
+    else:
+        amount = _param(noise_amount, n, 'noise_amount')
+
+        assert np.all(amount > 0), "Argument 'noise_amount' must be greater than zero."
+
+    imgs_new = np.empty_like(imgs) if out is None else out
+
+    # Noise is computed for chunks of images in one float32 buffer which
+    # stays in cache, instead of a float copy of the whole batch.
+    step = max(1, _NOISE_CHUNK // imgs[0].size)
+    buffer = np.empty((min(step, n),) + imgs.shape[1:], dtype = np.float32)
+    for i in range(0, n, step):
+        chunk = slice(i, min(i + step, n))
+        noise = buffer[: chunk.stop - i]
+
+        if noise_type == 'gaussian':
+            if noise_bank is None:
+                _standard_normal(rng, noise)
+            else:
+                for j in range(len(noise)):
+                    noise[j] = noise_bank.sample(imgs.shape[1:], rng)
+            noise *= expand(var[chunk]**0.5 * 255)
+            noise += expand(mean[chunk] * 255)
+        else:
+            noise[...] = imgs[chunk]
+            noise *= expand(amount[chunk] / 255)
+            noise[...] = rng.poisson(noise)
+            noise *= expand(255 / amount[chunk])
+
+        noise += imgs[chunk]
+        np.clip(noise, 0, 255, out = noise)
+        imgs_new[chunk] = noise
+
+    return imgs_new
+
+
+@instrument
+def randomErase(imgs, size, rects = None, rng = None, out = None, inplace = False):
+    '''Replaces one rectangle of every image with the image mean. The
+    rectangles of size 'size' (w, h) are drawn for the whole batch at
+    once, or passed as 'rects' of shape (N, 4) in the format -
+    (x1, y1, x2, y2).'''
+
+    assert type(size) == tuple and len(size) == 2 and (type(size[0]) == int and type(size[1]) == int), "Argument 'size' can only be of type tuple and values inside 'size' must be of type int."
+
+    _check_batch(imgs)
+    n, h, w = imgs.shape[:3]
+
+    assert (size[0] < w and size[1] < h), "Values inside 'size' must be smaller then image dimensions."
+
+    if rects is None:
+        rng = _get_rng(rng)
+        x = rng.integers(0, w - size[0], n)
+        y = rng.integers(0, h - size[1], n)
+        rects = np.stack([x, y, x + size[0], y + size[1]], axis = 1)
+    else:
+        assert (type(rects) == np.ndarray and rects.shape == (n, 4)), "Argument 'rects' must be a numpy.ndarray of shape (N, 4)."
+
+    rects = rects.astype(np.int64)
+    # Every image is summed as one flat channel, cv2.sumElems takes at
+    # most 4 channels.
+    fill = [int(cv2.sumElems(imgs[i].reshape(-1))[0]) // imgs[i].size for i in range(n)]
+
+    imgs_new = _copy_into(imgs, _check_out(imgs, out, inplace))
+
+    # Slice assignments touch only the rectangles, a batch wide mask
+    # would touch every pixel.
+    for i, (x1, y1, x2, y2) in enumerate(rects.tolist()):
+        imgs_new[i, y1:y2, x1:x2] = fill[i]
+
+    return imgs_new
+
+
+@instrument
+def randomCropAdd(imgs, size, rects = None, rng = None, out = None, inplace = False):
+    '''Crops one region of 'size' (w, h) of every image and pastes it at
+    another location of the same image. The regions of the whole batch
+    are drawn at once, or the regions to paste over are passed as
+    'rects' of shape (N, 4) in the format - (x1, y1, x2, y2), every one
+    of size 'size'.'''
+
+    assert type(size) == tuple and len(size) == 2 and (type(size[0]) == int and type(size[1]) == int), "Argument 'size' can only be of type tuple and values inside 'size' must be of type int."
+
+    _check_batch(imgs)
+    n, h, w = imgs.shape[:3]
+
+    assert (size[0] < w and size[1] < h), "Values inside 'size' must be smaller then image dimensions."
+
+    rng = _get_rng(rng)
+    if rects is None:
+        x = rng.integers(0, w - size[0], n)
+        y = rng.integers(0, h - size[1], n)
+        rects = np.stack([x, y, x + size[0], y + size[1]], axis = 1)
+    else:
+        assert (type(rects) == np.ndarray and rects.shape == (n, 4) and np.all(rects[:, 2:] - rects[:, :2] == size) and np.all(rects >= 0) and np.all(rects[:, 2] <= w) and np.all(rects[:, 3] <= h)), "Argument 'rects' must be a numpy.ndarray of shape (N, 4) of rectangles of 'size' inside the images."
+
+    sources = np.stack([rng.integers(0, w - size[0], n), rng.integers(0, h - size[1], n)], axis = 1)
+
+    imgs_new = _copy_into(imgs, _check_out(imgs, out, inplace))
+
+    # Patches are read from the passed batch. In place, the source and
+    # target region of an image can overlap, numpy copies the source
+    # first then.
+    for i, ((x1, y1, x2, y2), (x, y)) in enumerate(zip(rects.astype(np.int64).tolist(), sources.tolist())):
+        imgs_new[i, y1:y2, x1:x2] = imgs[i, y : y + size[1], x : x + size[0]]
+
+    return imgs_new
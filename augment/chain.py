@@ -0,0 +1,95 @@
+'''Chains of augmentation operations referenced by name, shared by the
+command line tool and the streaming iterator.'''
+
+import ast
+import inspect
+
+import numpy as np
+
+from . import geometric, kernel_based, photometric
+
+
+def _registry():
+    '''Returns all public image functions of the augmentation modules by
+    name - functions taking an 'img' argument, so helpers such as
+    'set_remap_cache' can not be used as operations.'''
+
+    ops = {}
+    for module in (geometric, photometric, kernel_based):
+        for name, func in inspect.getmembers(module, inspect.isfunction):
+            if not name.startswith('_') and func.__module__ == module.__name__ and 'img' in inspect.signature(func).parameters:
+                ops[name] = func
+    return ops
+
+
+OPS = _registry()
+
+
+def parse_op(spec):
+    '''Parses an operation written as a python call with literal arguments,
+    e.g. "blur('gaussian', ksize = (9, 9))". Returns (name, args, kwargs).'''
+
+    try:
+        node = ast.parse(spec.strip(), mode = 'eval').body
+    except SyntaxError:
+        raise ValueError("Operation '{}' is not a valid call.".format(spec))
+
+    if isinstance(node, ast.Name):
+        node = ast.Call(func = node, args = [], keywords = [])
+
+    if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Name)):
+        raise ValueError("Operation '{}' must be written as name(arguments).".format(spec))
+
+    name = node.func.id
+    if name not in OPS:
+        raise ValueError("Unknown operation '{}'. Available operations - {}.".format(name, ', '.join(sorted(OPS))))
+
+    try:
+        args = tuple(ast.literal_eval(arg) for arg in node.args)
+        kwargs = {kw.arg: ast.literal_eval(kw.value) for kw in node.keywords}
+    except ValueError:
+        raise ValueError("Arguments of operation '{}' must be literals.".format(spec))
+
+    return name, args, kwargs
+
+
+def _transform_boxes(func, img, boxes, *args, **kwargs):
+    '''Applies a geometric operation to the image and to the boxes which
+    are not [0,0,0,0] placeholders. Boxes which become degenerate are set
+    to [0,0,0,0], so the boxes keep lining up with the input boxes.
+    Returns the new image and boxes.'''
+
+    live = np.any(boxes != 0, axis = 1)
+    if not live.any():
+        return func(img, *args, **kwargs), boxes
+
+    img, boxes_live, degenerate = func(img, *args, box = boxes[live], **kwargs)
+    boxes_live[degenerate] = 0
+
+    boxes = np.zeros(boxes.shape, dtype = boxes_live.dtype)
+    boxes[live] = boxes_live
+    return img, boxes
+
+
+def apply_ops(img, boxes, ops):
+    '''Applies operations in order. Every operation is either a parsed
+    (name, args, kwargs) tuple or a callable taking and returning
+    (img, boxes). Boxes, an (N, 4) array or None, are carried through
+    the geometric operations and degenerate boxes are set to [0,0,0,0],
+    so the boxes keep lining up with the input boxes. Returns the new
+    image and boxes.'''
+
+    for op in ops:
+        if callable(op):
+            img, boxes = op(img, boxes)
+            continue
+
+        name, args, kwargs = op
+        func = OPS[name]
+
+        if func.__module__ == geometric.__name__ and boxes is not None and len(boxes) > 0:
+            img, boxes = _transform_boxes(func, img, boxes, *args, **kwargs)
+        else:
+            img = func(img, *args, **kwargs)
+
+    return img, boxes
@@ -0,0 +1,250 @@
+'''Command line tool for augmenting a whole directory of images.
+
+Example:
+    augment-auto images/ output/ --annotations boxes.json --workers 8
+        --op "rotate(angle = 15)" --op "addNoise('gaussian', var = 0.01)"
+
+Annotation file is a json object mapping image file names to lists of
+bounding boxes in the format - [[x1, y1, x2, y2], ...]. Boxes are carried
+through the geometric operations and written to 'annotations.json' in
+the output directory, index for index, with [0,0,0,0] for boxes which
+became degenerate.'''
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import cv2
+import numpy as np
+
+from .chain import apply_ops, parse_op
+
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp')
+CHECKPOINT_NAME = '.augment-checkpoint.jsonl'
+
+
+def _seed(seed, index):
+    '''Seeds the global random states for one image. Seeds depend only on
+    the base seed and the image index, so results do not depend on which
+    worker processes the image.'''
+
+    state = np.random.SeedSequence([seed, index]).generate_state(2)
+    random.seed(int(state[0]))
+    np.random.seed(state[1])
+
+
+# Per-process state of the pool workers.
+_worker = {}
+
+
+def _init_worker(ops, output_dir, seed):
+    # Each worker runs single threaded, parallelism comes from the pool.
+    cv2.setNumThreads(1)
+    _worker.update(ops = ops, output_dir = output_dir, seed = seed, shm = {})
+
+
+def _attach(name, live):
+    '''Returns the shared memory block 'name'. Attachments to blocks which
+    are no longer in 'live' were retired by the parent and are closed, so
+    their memory is freed.'''
+
+    from multiprocessing import shared_memory
+
+    for old in [old for old in _worker['shm'] if old not in live]:
+        _worker['shm'].pop(old).close()
+
+    if name not in _worker['shm']:
+        _worker['shm'][name] = shared_memory.SharedMemory(name = name)
+    return _worker['shm'][name]
+
+
+def _process(index, name, shm_name, live, shape, boxes):
+    '''Worker task. Reads the decoded frame from shared memory, applies
+    the operations and writes the result. Returns the new boxes.'''
+
+    shm = _attach(shm_name, live)
+    img = np.ndarray(shape, dtype = np.uint8, buffer = shm.buf)
+
+    _seed(_worker['seed'], index)
+    if boxes is not None:
+        boxes = np.array(boxes, dtype = np.float64).reshape(-1, 4)
+
+    img_new, boxes = apply_ops(img, boxes, _worker['ops'])
+
+    if not cv2.imwrite(os.path.join(_worker['output_dir'], name), img_new):
+        raise IOError("Could not write image '{}'.".format(name))
+
+    return None if boxes is None else boxes.tolist()
+
+
+class _SharedFrames:
+    '''Pool of reusable shared memory blocks used to hand decoded frames
+    to the worker processes without pickling them.'''
+
+    def __init__(self):
+        self.free = []
+        self.blocks = []
+
+    def acquire(self, nbytes):
+        from multiprocessing import shared_memory
+
+        for shm in sorted(self.free, key = lambda shm: shm.size):
+            if shm.size >= nbytes:
+                self.free.remove(shm)
+                return shm
+
+        if self.free:
+            # Replace the smallest free block, so the pool stays bounded.
+            shm = min(self.free, key = lambda shm: shm.size)
+            self.free.remove(shm)
+            self.blocks.remove(shm)
+            shm.close()
+            shm.unlink()
+
+        shm = shared_memory.SharedMemory(create = True, size = nbytes)
+        self.blocks.append(shm)
+        return shm
+
+    def names(self):
+        '''Returns names of the blocks in the pool.'''
+
+        return frozenset(shm.name for shm in self.blocks)
+
+    def release(self, shm):
+        self.free.append(shm)
+
+    def close(self):
+        for shm in self.blocks:
+            shm.close()
+            shm.unlink()
+        self.blocks, self.free = [], []
+
+
+def _load_checkpoint(path):
+    '''Returns results of the images which are already done.'''
+
+    done = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    record = json.loads(line)
+                    done[record['file']] = record['boxes']
+    return done
+
+
+def run(input_dir, output_dir, ops, annotations = None, workers = None, seed = 0, resume = True, verbose = True):
+    '''Augments every image of 'input_dir' with the parsed operations and
+    writes results to 'output_dir'. Decoding is done by a thread pool in
+    this process and augmentation by a pool of worker processes. Returns
+    a dict with the throughput summary.'''
+
+    workers = workers or os.cpu_count() or 1
+    os.makedirs(output_dir, exist_ok = True)
+
+    boxes_in = {}
+    if annotations is not None:
+        with open(annotations) as f:
+            boxes_in = json.load(f)
+
+    files = sorted(name for name in os.listdir(input_dir) if name.lower().endswith(IMAGE_EXTENSIONS))
+
+    checkpoint = os.path.join(output_dir, CHECKPOINT_NAME)
+    if not resume and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    done = _load_checkpoint(checkpoint)
+    pending = deque((index, name) for index, name in enumerate(files) if name not in done)
+
+    depth = 2 * workers
+    frames = _SharedFrames()
+    decoding, processing = deque(), {}
+    count, nbytes, skipped = 0, 0, 0
+    start = time.perf_counter()
+
+    def read(name):
+        return cv2.imread(os.path.join(input_dir, name), cv2.IMREAD_COLOR)
+
+    try:
+        with ThreadPoolExecutor(workers) as readers, \
+             ProcessPoolExecutor(workers, initializer = _init_worker, initargs = (ops, output_dir, seed)) as pool, \
+             open(checkpoint, 'a') as log:
+
+            while pending or decoding or processing:
+                while pending and len(decoding) + len(processing) < depth:
+                    index, name = pending.popleft()
+                    decoding.append((index, name, readers.submit(read, name)))
+
+                if decoding and len(processing) < depth:
+                    index, name, future = decoding.popleft()
+                    img = future.result()
+
+                    if img is None:
+                        print("Skipping '{}', image could not be read.".format(name), file = sys.stderr)
+                        skipped += 1
+                        continue
+
+                    shm = frames.acquire(img.nbytes)
+                    np.ndarray(img.shape, dtype = np.uint8, buffer = shm.buf)[...] = img
+                    boxes = boxes_in.get(name) if annotations is not None else None
+                    task = pool.submit(_process, index, name, shm.name, frames.names(), img.shape, boxes)
+                    processing[task] = (name, shm, img.nbytes)
+                    continue
+
+                finished, _ = wait(list(processing), return_when = FIRST_COMPLETED)
+                for task in finished:
+                    name, shm, size = processing.pop(task)
+                    frames.release(shm)
+                    log.write(json.dumps({'file': name, 'boxes': task.result()}) + '\n')
+                    log.flush()
+                    count += 1
+                    nbytes += size
+    finally:
+        frames.close()
+
+    elapsed = time.perf_counter() - start
+
+    if annotations is not None:
+        with open(os.path.join(output_dir, 'annotations.json'), 'w') as f:
+            json.dump(_load_checkpoint(checkpoint), f)
+
+    summary = {'images': count, 'skipped': skipped, 'resumed': len(done), 'seconds': elapsed,
+               'images_per_second': count / elapsed if elapsed > 0 else 0.0,
+               'mb_per_second': nbytes / 2**20 / elapsed if elapsed > 0 else 0.0}
+
+    if verbose:
+        print("{images} images in {seconds:.2f}s - {images_per_second:.1f} images/s, {mb_per_second:.1f} MB/s "
+              "({resumed} resumed from checkpoint, {skipped} skipped)".format(**summary))
+
+    return summary
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(prog = 'augment-auto', description = 'Augment a directory of images in parallel.')
+    parser.add_argument('input_dir', help = 'directory with the input images')
+    parser.add_argument('output_dir', help = 'directory for the augmented images')
+    parser.add_argument('--annotations', help = 'json file mapping image names to lists of boxes [x1, y1, x2, y2]')
+    parser.add_argument('--op', action = 'append', default = [], dest = 'ops',
+                        help = "operation to apply, e.g. \"rotate(angle = 15)\". Can be repeated, operations are applied in order.")
+    parser.add_argument('--workers', type = int, default = None, help = 'number of worker processes (default: cpu count)')
+    parser.add_argument('--seed', type = int, default = 0, help = 'base random seed')
+    parser.add_argument('--no-resume', action = 'store_false', dest = 'resume', help = 'ignore existing checkpoint and start over')
+    args = parser.parse_args(argv)
+
+    try:
+        ops = [parse_op(spec) for spec in args.ops]
+    except ValueError as e:
+        parser.error(str(e))
+
+    run(args.input_dir, args.output_dir, ops, annotations = args.annotations,
+        workers = args.workers, seed = args.seed, resume = args.resume)
+
+
+if __name__ == '__main__':
+    main()
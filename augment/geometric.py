@@ -1,11 +1,350 @@
 import cv2
 import numpy as np
+import threading
+from collections import OrderedDict
+from ._common import _check_out, _get_rng, _out_shape
+from .profiling import instrument
 
 
-def crop(img, point1, point2, box = None):
+def _rotation_matrix(shape, angle, keep_resolution = True):
+    '''Returns the 2x3 rotation matrix about the image centre and
+    the output size (w, h) of the rotated image.'''
+    
+    h, w = shape[:2]
+    M = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+    
+    if keep_resolution == True:
+        return M, (w, h)
+    
+    cos, sin = np.abs(M[0, 0]), np.abs(M[0, 1])
+    nW, nH = int((h * sin) + (w * cos)), int((h * cos) + (w * sin))
+    M[0, 2] += (nW / 2) - (w / 2)
+    M[1, 2] += (nH / 2) - (h / 2)
+    return M, (nW, nH)
+
+
+def _scale_matrix(shape, fx, fy, keep_resolution = False):
+    '''Returns the 2x3 scaling matrix and the output size (w, h)
+    of the scaled image. With keep_resolution, the centre of the
+    scaled image is cropped back to the original resolution.'''
+    
+    h, w = shape[:2]
+    nW, nH = int(round(w * fx)), int(round(h * fy))
+    M = np.float64([[fx, 0, 0],
+                    [0, fy, 0]])
+    
+    if keep_resolution == False:
+        return M, (nW, nH)
+    
+    x1, y1 = int(nW/2 - w/2), int(nH/2 - h/2)
+    x2, y2 = int(nW/2 + w/2), int(nH/2 + h/2)
+    M[0, 2] -= x1
+    M[1, 2] -= y1
+    return M, (x2 - x1, y2 - y1)
+
+
+def _scale_pixels(M, dsize, fx, fy):
+    '''Returns the scaling matrix, the output size and the matrix mapping
+    pixel centres, with which the image is scaled in the same way as
+    'cv2.resize' does.'''
+    
+    return M, dsize, M + [[0, 0, 0.5*fx - 0.5], [0, 0, 0.5*fy - 0.5]]
+
+
+def _shear_matrix(shear_val, axis = 0):
+    '''Returns the 2x3 shear matrix along the given axis.'''
+    
+    if axis == 0:
+        return np.float64([[1, shear_val, 0],
+                           [0, 1, 0]])
+    
+    return np.float64([[1, 0, 0],
+                       [shear_val, 1, 0]])
+
+
+def _translate_matrix(tx, ty):
+    '''Returns the 2x3 translation matrix.'''
+    
+    return np.float64([[1, 0, tx],
+                       [0, 1, ty]])
+
+
+class RemapCache:
+    '''LRU cache of fixed-point 'cv2.remap' maps for repeated warps of
+    same-shape images. Maps are keyed by operation, image shape, output
+    size and the affine matrix rounded to 'decimals' places, and stored
+    in the compact CV_16SC2 format (6 bytes per output pixel). Least
+    recently used maps are evicted once 'max_bytes' is exceeded.
+    
+    Example:
+        set_remap_cache(RemapCache(max_bytes = 512 * 2**20))
+        img_new = rotate(img, 15)      # builds the map
+        img_new = rotate(img2, 15)     # reuses it
+        print(get_remap_cache().stats())'''
+    
+    def __init__(self, max_bytes = 256 * 2**20, decimals = 6):
+        assert type(max_bytes) == int and max_bytes > 0, "Argument 'max_bytes' must be a positive int."
+        
+        assert type(decimals) == int and decimals >= 0, "Argument 'decimals' must be a non-negative int."
+        
+        self.max_bytes = max_bytes
+        self.decimals = decimals
+        self._maps = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def maps(self, op, M, shape, dsize):
+        '''Returns (map1, map2) for warping an image of 'shape' with the
+        2x3 matrix 'M' into an output of size 'dsize' (w, h).'''
+        
+        key = (op, tuple(shape[:2]), tuple(dsize), tuple(np.round(np.asarray(M, dtype = np.float64), self.decimals).ravel()))
+        
+        with self._lock:
+            if key in self._maps:
+                self._maps.move_to_end(key)
+                self.hits += 1
+                return self._maps[key]
+            self.misses += 1
+        
+        maps = _remap_maps(M, dsize)
+        nbytes = maps[0].nbytes + maps[1].nbytes
+        
+        with self._lock:
+            if nbytes <= self.max_bytes and key not in self._maps:
+                self._maps[key] = maps
+                self.bytes += nbytes
+                while self.bytes > self.max_bytes:
+                    _, old = self._maps.popitem(last = False)
+                    self.bytes -= old[0].nbytes + old[1].nbytes
+                    self.evictions += 1
+        return maps
+    
+    def stats(self):
+        '''Returns hit, miss and eviction counts, number of cached maps and their size in bytes.'''
+        
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'entries': len(self._maps), 'bytes': self.bytes, 'max_bytes': self.max_bytes}
+    
+    def clear(self):
+        with self._lock:
+            self._maps.clear()
+            self.bytes = 0
+
+
+_remap_cache = None
+
+
+def set_remap_cache(cache):
+    '''Enables caching of remap maps in rotate, shear, translate and
+    AffinePipeline. Pass a RemapCache to enable or None to disable.'''
+    
+    global _remap_cache
+    
+    assert cache is None or isinstance(cache, RemapCache), "Argument 'cache' must be a RemapCache or None."
+    
+    _remap_cache = cache
+
+
+def get_remap_cache():
+    '''Returns the active RemapCache or None.'''
+    
+    return _remap_cache
+
+
+def _remap_maps(M, dsize):
+    '''Returns fixed-point maps equivalent to 'cv2.warpAffine' with
+    the 2x3 matrix 'M' into an output of size 'dsize' (w, h).'''
+    
+    Mi = cv2.invertAffineTransform(np.asarray(M, dtype = np.float64))
+    xs = np.arange(dsize[0], dtype = np.float32)
+    ys = np.arange(dsize[1], dtype = np.float32)[:, None]
+    map_x = np.float32(Mi[0, 0]) * xs + (np.float32(Mi[0, 1]) * ys + np.float32(Mi[0, 2]))
+    map_y = np.float32(Mi[1, 0]) * xs + (np.float32(Mi[1, 1]) * ys + np.float32(Mi[1, 2]))
+    return cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)
+
+
+def _warp(img, M, dsize, op, out = None, border = cv2.BORDER_CONSTANT):
+    '''Warps the image with the 2x3 matrix 'M', using cached remap
+    maps if a RemapCache is enabled.'''
+    
+    if _remap_cache is None:
+        return cv2.warpAffine(img, M, dsize, dst = out, borderMode = border)
+    
+    map1, map2 = _remap_cache.maps(op, M, img.shape, dsize)
+    return cv2.remap(img, map1, map2, cv2.INTER_LINEAR, dst = out, borderMode = border)
+
+
+def _check_boxes(box):
+    '''Validates 'box' argument and returns it as an (N, 4) array.
+    A single box can be passed as a list of four values, multiple
+    boxes as a numpy.ndarray of shape (N, 4).'''
+    
+    if type(box) == list:
+        assert len(box) == 4, "Argument 'box' must be of type list and must have a lenght of four."
+    else:
+        assert (type(box) == np.ndarray and box.ndim == 2 and box.shape[1] == 4), "Argument 'box' must be a list of length four or a numpy.ndarray of shape (N, 4)."
+    
+    boxes = np.array(box, ndmin = 2)
+    
+    assert np.all((boxes[:, 0] < boxes[:, 2]) & (boxes[:, 1] < boxes[:, 3])), "Top-left coordinates of bounding box must be smaller than bottom-right coordinates."
+    
+    return boxes
+
+
+def _warp_boxes(M, boxes):
+    '''Maps the four corners of every box through the 2x3 affine
+    matrix 'M' with a single matrix multiply and returns the
+    axis-aligned boxes enclosing the transformed corners.'''
+    
+    corners = boxes[:, [0, 1, 0, 3, 2, 3, 2, 1]].reshape(-1, 4, 2)
+    corners = corners @ np.asarray(M[:, :2], dtype = np.float64).T + M[:, 2]
+    return np.concatenate([corners.min(axis = 1), corners.max(axis = 1)], axis = 1)
+
+
+def _clip_boxes(boxes, shape):
+    '''Clamps boxes to the image of the given shape. Returns the
+    clamped boxes and a mask of boxes which became degenerate.'''
+    
+    h, w = shape[:2]
+    boxes = boxes.copy()
+    boxes[:, 0::2] = np.clip(boxes[:, 0::2], 0, w-1)
+    boxes[:, 1::2] = np.clip(boxes[:, 1::2], 0, h-1)
+    degenerate = (boxes[:, 0] == boxes[:, 2]) | (boxes[:, 1] == boxes[:, 3])
+    return boxes, degenerate
+
+
+def _return_boxes(img_new, box, boxes, degenerate):
+    '''Returns output in the format of the passed 'box'. A list
+    gives back a list, with [0,0,0,0] if the box is degenerate.
+    An ndarray gives back the (N, 4) boxes and the degenerate mask.'''
+    
+    if type(box) == np.ndarray:
+        return img_new, boxes, degenerate
+    
+    if degenerate[0]:
+        return img_new, [0,0,0,0]
+    
+    return img_new, boxes[0].tolist()
+
+
+# Mask types OpenCV warps with nearest-neighbour interpolation (bool as
+# uint8) and the most channels an OpenCV array can hold.
+_MASK_DTYPES = tuple(np.dtype(t) for t in (bool, np.uint8, np.int8, np.uint16, np.int16, np.int32, np.float32, np.float64))
+_MAX_CHANNELS = 128
+
+
+def _check_targets(img, masks, keypoints, polygons):
+    '''Validates the optional masks, keypoints and polygons arguments.'''
+    
+    if masks is not None:
+        assert (type(masks) == np.ndarray and masks.ndim in (2, 3) and masks.shape[:2] == img.shape[:2]), "Argument 'masks' must be a numpy.ndarray of shape (h, w) or (h, w, k) matching the image."
+        
+        assert masks.dtype in _MASK_DTYPES, "Argument 'masks' must be of type bool, uint8, int8, uint16, int16, int32, float32 or float64."
+    
+    if keypoints is not None:
+        assert (type(keypoints) == np.ndarray and keypoints.ndim == 2 and keypoints.shape[1] == 2), "Argument 'keypoints' must be a numpy.ndarray of shape (N, 2)."
+    
+    if polygons is not None:
+        assert ((type(polygons) == np.ndarray and polygons.ndim == 3 and polygons.shape[2] == 2) or
+                (type(polygons) == list and all(np.ndim(p) == 2 and np.shape(p)[1] == 2 for p in polygons))), "Argument 'polygons' must be a numpy.ndarray of shape (N, K, 2) or a list of arrays of shape (K, 2)."
+
+
+def _warp_masks(masks, M, dsize, resize = False):
+    '''Warps masks of shape (h, w) or (h, w, k) with nearest-neighbour
+    interpolation, all mask channels in one call. Only masks with more
+    channels than OpenCV arrays can hold are split. Bool masks are
+    warped as uint8.'''
+    
+    if resize == True:
+        warp = lambda m: cv2.resize(m, dsize, interpolation = cv2.INTER_NEAREST)
+    else:
+        warp = lambda m: cv2.warpAffine(m, M, dsize, flags = cv2.INTER_NEAREST)
+    
+    shape = (dsize[1], dsize[0]) + masks.shape[2:]
+    source = masks.view(np.uint8) if masks.dtype == bool else masks
+    
+    if masks.ndim == 2 or masks.shape[2] <= _MAX_CHANNELS:
+        masks_new = warp(source).reshape(shape)
+    else:
+        masks_new = np.empty(shape, dtype = source.dtype)
+        for i in range(0, masks.shape[2], _MAX_CHANNELS):
+            masks_new[:, :, i : i + _MAX_CHANNELS] = warp(np.ascontiguousarray(source[:, :, i : i + _MAX_CHANNELS])).reshape(dsize[1], dsize[0], -1)
+    
+    return masks_new.view(bool) if masks.dtype == bool else masks_new
+
+
+def _warp_points(M, points):
+    '''Maps points of shape (N, 2) through the 2x3 affine matrix 'M'.'''
+    
+    return np.asarray(points, dtype = np.float64) @ np.asarray(M[:, :2], dtype = np.float64).T + M[:, 2]
+
+
+def _warp_polygons(M, polygons):
+    '''Maps all polygons through 'M' with a single matrix multiply and
+    returns them in the passed format.'''
+    
+    if type(polygons) == np.ndarray:
+        return _warp_points(M, polygons.reshape(-1, 2)).reshape(polygons.shape)
+    
+    lengths = [len(p) for p in polygons]
+    points = _warp_points(M, np.concatenate([np.asarray(p, dtype = np.float64) for p in polygons]))
+    return np.split(points, np.cumsum(lengths)[:-1])
+
+
+def _polygon_boxes(polygons):
+    '''Returns the tight (N, 4) boxes enclosing every polygon.'''
+    
+    if type(polygons) == np.ndarray:
+        return np.concatenate([polygons.min(axis = 1), polygons.max(axis = 1)], axis = 1)
+    
+    points = np.concatenate(polygons)
+    starts = np.cumsum([0] + [len(p) for p in polygons[:-1]])
+    return np.concatenate([np.minimum.reduceat(points, starts), np.maximum.reduceat(points, starts)], axis = 1)
+
+
+def _target_boxes(M, boxes, polygons_new):
+    '''Returns boxes mapped through 'M'. When there is one transformed
+    polygon per box, boxes are recomputed tightly from the polygons
+    instead of from the transformed box corners.'''
+    
+    if polygons_new is not None and len(polygons_new) == len(boxes):
+        return _polygon_boxes(polygons_new)
+    return _warp_boxes(M, boxes)
+
+
+def _warp_targets(M, dsize, masks, keypoints, polygons, resize = False):
+    '''Returns the list of warped masks, keypoints and polygons, for
+    those which were passed, and the warped polygons or None.'''
+    
+    targets, polygons_new = [], None
+    if masks is not None:
+        targets.append(_warp_masks(masks, M, dsize, resize))
+    if keypoints is not None:
+        targets.append(_warp_points(M, keypoints))
+    if polygons is not None:
+        polygons_new = _warp_polygons(M, polygons)
+        targets.append(polygons_new)
+    return targets, polygons_new
+
+
+def _with_targets(result, targets):
+    '''Appends the warped targets to the output of a geometric function.'''
+    
+    if not targets:
+        return result
+    return (result if type(result) == tuple else (result,)) + tuple(targets)
+
+
+@instrument
+def crop(img, point1, point2, box = None, out = None):
     ''' Returns cropped image from point1 to point2. 
     If box coordinates are passed, new bounding box 
-    coordinates are calculated and returned.'''
+    coordinates are calculated and returned. Cropped
+    region is written into 'out' array if passed.'''
     
     assert ((type(point1) == tuple and len(point1) == 2) and (type(point2) == tuple and len(point2) == 2)), "'point1' and 'point2' must be of type tuple and must have a lenght of two."
     
@@ -15,240 +354,359 @@ def crop(img, point1, point2, box = None):
     
     x1, y1 = point1[0], point1[1]
     x2, y2 = point2[0], point2[1]
-    img_new = img.copy()
-    img_new = img_new[y1:y2, x1:x2]
+    out = _check_out(img, out, shape = (y2 - y1, x2 - x1) + img.shape[2:])
+    
+    if out is None:
+        img_new = img[y1:y2, x1:x2].copy()
+    else:
+        img_new = out
+        img_new[...] = img[y1:y2, x1:x2]
     
-    if box == None:
+    if box is None:
         return img_new
     
     else:
         ''' New bounding box coordinates calculation
         after image cropping.'''
         
-        assert (type(box) == list and len(box) == 4), "Argument 'box' must be of type list and must have a lenght of four."
+        boxes = _check_boxes(box)
+        boxes_new, degenerate = _clip_boxes(boxes - [x1, y1, x1, y1], img_new.shape)
         
-        assert (box[0] < box[2] and box[1] < box[3]), "Top-left coordinates of bounding box must be smaller than bottom-right coordinates."
+        # Boxes enclosing the whole crop window cover the full output.
+        inside = (boxes[:, 0] <= x1) & (boxes[:, 2] >= x2) & (boxes[:, 1] <= y1) & (boxes[:, 3] >= y2)
+        boxes_new[inside] = [0, 0, img_new.shape[1], img_new.shape[0]]
+        degenerate[inside] = False
         
-        box_new = []
-        
-        if (x1 >= box[0] and x2 <= box[2]) and (y1 >= box[1] and y2 <= box[3]):
-            box_new = [0, 0, img_new.shape[1], img_new.shape[0]]
-            
-        else:
-            box_new.append(min(max(0, box[0] - x1), img_new.shape[1]-1))
-            box_new.append(min(max(0, box[1] - y1), img_new.shape[0]-1))
-            box_new.append(min(max(0, box[2] - x1), img_new.shape[1]-1))
-            box_new.append(min(max(0, box[3] - y1), img_new.shape[0]-1))
-        
-        if (box_new[0] == box_new[2]) or (box_new[1] == box_new[3]):
-            box_new = [0,0,0,0]
-            
-        return img_new, box_new
+        return _return_boxes(img_new, box, boxes_new, degenerate)
     
 
-def rotate(img, angle, keep_resolution = True, box = None):
+@instrument
+def rotate(img, angle, keep_resolution = True, box = None, out = None, inplace = False, masks = None, keypoints = None, polygons = None):
     '''Returns rotated image at the given angle. Resolution
     of the image remains the same if keep_resolution argument
-    is True, otherwise it changes accordingly.'''
+    is True, otherwise it changes accordingly. Result is
+    written into 'out' array, or into 'img' itself if
+    inplace is True. Passed masks, keypoints and polygons
+    are transformed too and returned after the boxes.'''
     
     assert (type(angle) == int or type(angle) == float), "Argument 'angle' must be of type int or float."
     
     assert (type(keep_resolution) == bool), "Argument 'keep_resolution' can only be True or False."
 
-    img_new = img.copy()
-    h, w = img_new.shape[:2]
-    M = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
-    cos, sin = np.abs(M[0, 0]), np.abs(M[0, 1])
-    
-    if keep_resolution == True:
-        img_new = cv2.warpAffine(img_new, M, (w, h))
-        
-    else:
-        nW, nH = int((h * sin) + (w * cos)), int((h * cos) + (w * sin))
-        M[0, 2] += (nW / 2) - (w / 2)
-        M[1, 2] += (nH / 2) - (h / 2)
-        img_new = cv2.warpAffine(img_new, M, (nW, nH))
+    _check_targets(img, masks, keypoints, polygons)
+
+    M, dsize = _rotation_matrix(img.shape, angle, keep_resolution)
+    out = _check_out(img, out, inplace, _out_shape(img, dsize))
+    targets, polygons_new = _warp_targets(M, dsize, masks, keypoints, polygons)
+    img_new = _warp(img, M, dsize, 'rotate', out)
     
-    if box == None:
-        return img_new
+    if box is None:
+        return _with_targets(img_new, targets)
 
     else:
         ''' New bounding box coordinates calculation after image rotation.'''
         
-        assert (type(box) == list and len(box) == 4), "Argument 'box' must be of type list and must have a lenght of four."
+        boxes = _check_boxes(box)
+        boxes_new, degenerate = _clip_boxes(_target_boxes(M, boxes, polygons_new), img_new.shape)
         
-        assert (box[0] < box[2] and box[1] < box[3]), "Top-left coordinates of bounding box must be smaller than bottom-right coordinates."
-        
-        box_new = []
-        box_temp = [box[0], box[1], box[0], box[3], box[2], box[3], box[2], box[1]]
-
-        box_temp[0:2] = np.dot(M, [box_temp[0], box_temp[1], 1])[0:2]
-        box_temp[2:4] = np.dot(M, [box_temp[2], box_temp[3], 1])[0:2]
-        box_temp[4:6] = np.dot(M, [box_temp[4], box_temp[5], 1])[0:2]
-        box_temp[6:8] = np.dot(M, [box_temp[6], box_temp[7], 1])[0:2]
-
-        box_new.append(min(box_temp[0], box_temp[2], box_temp[4], box_temp[6]))
-        box_new.append(min(box_temp[1], box_temp[3], box_temp[5], box_temp[7]))
-        box_new.append(max(box_temp[0], box_temp[2], box_temp[4], box_temp[6]))
-        box_new.append(max(box_temp[1], box_temp[3], box_temp[5], box_temp[7]))
-
-        box_new[0] = min(max(0, box_new[0]), img_new.shape[1]-1)
-        box_new[1] = min(max(0, box_new[1]), img_new.shape[0]-1)
-        box_new[2] = min(max(0, box_new[2]), img_new.shape[1]-1)
-        box_new[3] = min(max(0, box_new[3]), img_new.shape[0]-1)
-        
-        if (box_new[0] == box_new[2]) or (box_new[1] == box_new[3]):
-            box_new = [0,0,0,0]
-
-        return img_new, box_new
+        return _with_targets(_return_boxes(img_new, box, boxes_new, degenerate), targets)
 
 
-def scale(img, fx, fy, keep_resolution = False, box = None):
+@instrument
+def scale(img, fx, fy, keep_resolution = False, box = None, out = None, inplace = False, masks = None, keypoints = None, polygons = None):
     ''' Scales the image resolution w.r.t. x and y axis to
-    the given scaling factor 'fx' and 'fy'.'''
+    the given scaling factor 'fx' and 'fy'. Result is
+    written into 'out' array, or into 'img' itself if
+    inplace is True. Passed masks, keypoints and polygons
+    are transformed too and returned after the boxes.'''
     
     assert ((type(fx) == int or type(fx) == float) and (type(fy) == int or type(fy) == float)), "Arguments 'fx' and 'fy' must be of type int or float."
     
     assert (fx > 0 and fy > 0), "Arguments 'fx' and 'fy' must be greater than 0"
 
-    img_new = img.copy()
-    img_new = cv2.resize(img_new, dsize = None, fx=fx, fy=fy)
-    
     if (fx < 1 or fy < 1) and keep_resolution == True:
         keep_resolution = False
         print("'keep_resolution' can only be True when fx,fy >= 1. Switching 'keep_resolution' to False")
-        
     
-    if keep_resolution == True:
-        x1, y1 = int(img_new.shape[1]/2 - img.shape[1]/2), int(img_new.shape[0]/2 - img.shape[0]/2)
-        x2, y2 = int(img_new.shape[1]/2 + img.shape[1]/2), int(img_new.shape[0]/2 + img.shape[0]/2)
-        img_new = img_new[y1:y2, x1:x2]
+    _check_targets(img, masks, keypoints, polygons)
     
-    if box == None:
-        return img_new
+    M, dsize = _scale_matrix(img.shape, fx, fy, keep_resolution)
+    out = _check_out(img, out, inplace, _out_shape(img, dsize))
+    
+    if keep_resolution == False:
+        targets, polygons_new = _warp_targets(M, dsize, masks, keypoints, polygons, resize = True)
+        img_new = cv2.resize(img, dsize, dst = out)
+    
+    else:
+        # Only the kept centre is computed, without the full size
+        # intermediate image. Pixel centres are mapped in the same
+        # way as 'cv2.resize' does.
+        M_pixels = _scale_pixels(M, dsize, fx, fy)[2]
+        targets, polygons_new = _warp_targets(M, dsize, None, keypoints, polygons)
+        if masks is not None:
+            targets.insert(0, _warp_masks(masks, M_pixels, dsize))
+        img_new = _warp(img, M_pixels, dsize, 'scale', out, cv2.BORDER_REPLICATE)
+    
+    if box is None:
+        return _with_targets(img_new, targets)
     
     else:
         ''' New bounding box coordinates calculation
         after image cropping.'''
         
-        assert (type(box) == list and len(box) == 4), "Argument 'box' must be of type list and must have a lenght of four."
+        boxes = _check_boxes(box)
+        boxes_new = _target_boxes(M, boxes, polygons_new)
         
-        assert (box[0] < box[2] and box[1] < box[3]), "Top-left coordinates of bounding box must be smaller than bottom-right coordinates."
-            
-        box_new = []
-        box_new.append(box[0] * fx)
-        box_new.append(box[1] * fy)
-        box_new.append(box[2] * fx)
-        box_new.append(box[3] * fy)
-        
-        if keep_resolution == True:
-            if (x1 >= box_new[0] and x2 <= box_new[2]) and (y1 >= box[1] and y2 <= box[3]):
-                box_new = [0, 0, img_new.shape[1], img_new.shape[0]]
-
-            else:
-                box_new[0] = min(max(0, box_new[0] - x1), img_new.shape[1]-1)
-                box_new[1] = min(max(0, box_new[1] - y1), img_new.shape[0]-1)
-                box_new[2] = min(max(0, box_new[2] - x1), img_new.shape[1]-1)
-                box_new[3] = min(max(0, box_new[3] - y1), img_new.shape[0]-1)
-
-            if (box_new[0] == box_new[2]) or (box_new[1] == box_new[3]):
-                box_new = [0,0,0,0]
+        if keep_resolution == False:
+            # Scaled boxes are not clamped, degenerate boxes can not occur.
+            return _with_targets(_return_boxes(img_new, box, boxes_new, np.zeros(len(boxes), dtype = bool)), targets)
+        
+        inside = (boxes_new[:, 0] <= 0) & (boxes_new[:, 2] >= dsize[0]) & (boxes_new[:, 1] <= 0) & (boxes_new[:, 3] >= dsize[1])
+        boxes_new, degenerate = _clip_boxes(boxes_new, img_new.shape)
+        boxes_new[inside] = [0, 0, img_new.shape[1], img_new.shape[0]]
+        degenerate[inside] = False
             
-        return img_new, box_new
+        return _with_targets(_return_boxes(img_new, box, boxes_new, degenerate), targets)
 
         
-def shear(img, shear_val, axis = 0, box = None):
+@instrument
+def shear(img, shear_val, axis = 0, box = None, out = None, inplace = False, masks = None, keypoints = None, polygons = None):
     '''Shears image w.r.t. either x axis or y axis 
     with shear magnitude equal to 'shear_val'. x or
-    y axis can be choosen with 'axis' argument.'''
+    y axis can be choosen with 'axis' argument. Result
+    is written into 'out' array, or into 'img' itself
+    if inplace is True. Passed masks, keypoints and
+    polygons are transformed too and returned after
+    the boxes.'''
 
     assert (type(shear_val) == int or type(shear_val) == float), "Argument 'shear_val' must be of type int or float."
     
     assert (axis == 0 or axis == 1), "Value of argument 'axis' must be either 0 or 1."
 
-    img_new = img.copy()
-    
-    if axis == 0:
-        M = np.float32([[1, shear_val, 0],
-                        [0, 1, 0]])
-    else:
-        M = np.float32([[1, 0, 0],
-                        [shear_val, 1, 0]])
-        
-    img_new = cv2.warpAffine(img_new, M, (img_new.shape[1], img_new.shape[0]))
+    _check_targets(img, masks, keypoints, polygons)
+
+    M = _shear_matrix(shear_val, axis)
+    out = _check_out(img, out, inplace)
+    targets, polygons_new = _warp_targets(M, (img.shape[1], img.shape[0]), masks, keypoints, polygons)
+    img_new = _warp(img, M, (img.shape[1], img.shape[0]), 'shear', out)
     
-    if box == None:
-        return img_new
+    if box is None:
+        return _with_targets(img_new, targets)
     
     else:
         ''' New bounding box coordinates calculation
-        after image cropping.'''
-        
-        assert (type(box) == list and len(box) == 4), "Argument 'box' must be of type list and must have a lenght of four."
-        
-        assert (box[0] < box[2] and box[1] < box[3]), "Top-left coordinates of bounding box must be smaller than bottom-right coordinates."
-        
-        box_new = box.copy()
-        box_temp = [box[0], box[1], box[0], box[3], box[2], box[3], box[2], box[1]]
-        
-        if axis == 0:
-            box_temp[0] = box_temp[0] + shear_val * box_temp[1]
-            box_temp[2] = box_temp[2] + shear_val * box_temp[3]
-            box_temp[4] = box_temp[4] + shear_val * box_temp[5]
-            box_temp[6] = box_temp[6] + shear_val * box_temp[7]
-            
-            box_new[0] = min(box_temp[0], box_temp[2], box_temp[4], box_temp[6])
-            box_new[2] = max(box_temp[0], box_temp[2], box_temp[4], box_temp[6])
-            
-        else:
-            box_temp[1] = box_temp[1] + shear_val * box_temp[0]
-            box_temp[3] = box_temp[3] + shear_val * box_temp[2]
-            box_temp[5] = box_temp[5] + shear_val * box_temp[4]
-            box_temp[7] = box_temp[7] + shear_val * box_temp[6]
-            
-            box_new[1] = min(box_temp[1], box_temp[3], box_temp[5], box_temp[7])
-            box_new[3] = max(box_temp[1], box_temp[3], box_temp[5], box_temp[7])
-            
-        box_new[0] = min(max(0, box_new[0]), img_new.shape[1]-1)
-        box_new[1] = min(max(0, box_new[1]), img_new.shape[0]-1)
-        box_new[2] = min(max(0, box_new[2]), img_new.shape[1]-1)
-        box_new[3] = min(max(0, box_new[3]), img_new.shape[0]-1)
+        after image shearing.'''
         
-        if (box_new[0] == box_new[2]) or (box_new[1] == box_new[3]):
-            box_new = [0,0,0,0]
+        boxes = _check_boxes(box)
+        boxes_new, degenerate = _clip_boxes(_target_boxes(M, boxes, polygons_new), img_new.shape)
             
-        return img_new, box_new
+        return _with_targets(_return_boxes(img_new, box, boxes_new, degenerate), targets)
     
 
-def translate(img, tx, ty, box = None):
+@instrument
+def translate(img, tx, ty, box = None, out = None, inplace = False, masks = None, keypoints = None, polygons = None):
     '''Translates image w.r.t. x and y axis
-    to the given translation factor 'tx' and 'ty'.'''
+    to the given translation factor 'tx' and 'ty'.
+    Result is written into 'out' array, or into
+    'img' itself if inplace is True. Passed masks,
+    keypoints and polygons are transformed too and
+    returned after the boxes.'''
 
     assert ((type(tx) == int or type(tx) == float) and (type(ty) == int or type(ty) == float)), "Arguments 'tx' and 'tx' must be of type int or float."
 
-    img_new = img.copy()
-    M = np.float32([[1, 0, tx],
-                    [0, 1, ty]])
-    img_new = cv2.warpAffine(img_new, M, (img_new.shape[1],img_new.shape[0]))
+    _check_targets(img, masks, keypoints, polygons)
+
+    M = _translate_matrix(tx, ty)
+    out = _check_out(img, out, inplace)
+    targets, polygons_new = _warp_targets(M, (img.shape[1], img.shape[0]), masks, keypoints, polygons)
+    img_new = _warp(img, M, (img.shape[1], img.shape[0]), 'translate', out)
     
-    if box == None:
-        return img_new
+    if box is None:
+        return _with_targets(img_new, targets)
 
     else:
         ''' New bounding box coordinates calculation
-        after image cropping.'''
+        after image translation.'''
+        
+        boxes = _check_boxes(box)
+        if polygons_new is not None and len(polygons_new) == len(boxes):
+            boxes_new = _polygon_boxes(polygons_new)
+        else:
+            boxes_new = boxes + [tx, ty, tx, ty]
+        boxes_new, degenerate = _clip_boxes(boxes_new, img_new.shape)
+        
+        return _with_targets(_return_boxes(img_new, box, boxes_new, degenerate), targets)
+
+
+@instrument
+def random_resized_crop(img, size, scale = (0.08, 1.0), ratio = (3/4, 4/3), box = None, rng = None, out = None):
+    '''Crops a random region of the image and resizes it to 'size'
+    (w, h) in a single resampling pass, without copying the region
+    first. Area of the region is a random fraction 'scale' of the
+    image area and its aspect ratio (w/h) is drawn log-uniformly from
+    'ratio'. If box coordinates are passed, new bounding box
+    coordinates are calculated and returned. Result is written into
+    'out' array if passed.'''
+    
+    assert (type(size) == tuple and len(size) == 2 and type(size[0]) == int and type(size[1]) == int and size[0] > 0 and size[1] > 0), "Argument 'size' must be of type tuple with two positive int values - (w, h)."
+    
+    assert (type(scale) == tuple and len(scale) == 2 and 0 < scale[0] <= scale[1] <= 1), "Argument 'scale' must be of type tuple with two values - (min, max), where 0 < min <= max <= 1."
+    
+    assert (type(ratio) == tuple and len(ratio) == 2 and 0 < ratio[0] <= ratio[1]), "Argument 'ratio' must be of type tuple with two positive values - (min, max), where min <= max."
+    
+    h, w = img.shape[:2]
+    rng = _get_rng(rng)
+    out = _check_out(img, out, shape = (size[1], size[0]) + img.shape[2:])
+    
+    # Same sampling as torchvision's RandomResizedCrop - ten attempts,
+    # then the largest centre crop with the aspect ratio clamped to 'ratio'.
+    for _ in range(10):
+        area = h * w * rng.uniform(scale[0], scale[1])
+        aspect = np.exp(rng.uniform(np.log(ratio[0]), np.log(ratio[1])))
+        cw, ch = int(round(np.sqrt(area * aspect))), int(round(np.sqrt(area / aspect)))
+        if 0 < cw <= w and 0 < ch <= h:
+            x1, y1 = int(rng.integers(0, w - cw + 1)), int(rng.integers(0, h - ch + 1))
+            break
+    else:
+        if w / h < ratio[0]:
+            cw, ch = w, int(round(w / ratio[0]))
+        elif w / h > ratio[1]:
+            cw, ch = int(round(h * ratio[1])), h
+        else:
+            cw, ch = w, h
+        x1, y1 = (w - cw) // 2, (h - ch) // 2
+    
+    fx, fy = size[0] / cw, size[1] / ch
+    interpolation = cv2.INTER_AREA if (fx < 1 and fy < 1) else cv2.INTER_LINEAR
+    img_new = cv2.resize(img[y1 : y1 + ch, x1 : x1 + cw], size, dst = out, interpolation = interpolation)
+    
+    if box is None:
+        return img_new
+    
+    else:
+        ''' New bounding box coordinates calculation
+        after cropping and resizing.'''
+        
+        boxes = _check_boxes(box)
+        boxes_new = (boxes - [x1, y1, x1, y1]) * [fx, fy, fx, fy]
+        boxes_new, degenerate = _clip_boxes(boxes_new, img_new.shape)
+        
+        return _return_boxes(img_new, box, boxes_new, degenerate)
+
+
+class AffinePipeline:
+    '''Chain of rotate, scale, shear and translate operations which
+    are fused into a single affine matrix. The image is resampled
+    only once with one 'cv2.warpAffine' call, and bounding box is
+    mapped through the same combined matrix.
+    
+    Arguments are validated when an operation is added to the
+    pipeline, so calling the pipeline only checks the image and box.
+    
+    Example:
+        pipeline = AffinePipeline().rotate(15).scale(1.2, 1.2).translate(20, 10)
+        img_new, box_new = pipeline(img, box = [581, 274, 699, 321])'''
+    
+    def __init__(self):
+        self.ops = []
+        self.borders = []
+        self._cache = {}
+    
+    def rotate(self, angle, keep_resolution = True):
+        '''Adds rotation at the given angle. Arguments are same as 'rotate'.'''
+        
+        assert (type(angle) == int or type(angle) == float), "Argument 'angle' must be of type int or float."
+        
+        assert (type(keep_resolution) == bool), "Argument 'keep_resolution' can only be True or False."
+        
+        return self._add(lambda shape: _rotation_matrix(shape, angle, keep_resolution))
+    
+    def scale(self, fx, fy, keep_resolution = False):
+        '''Adds scaling by 'fx' and 'fy'. Arguments are same as 'scale'.'''
+        
+        assert ((type(fx) == int or type(fx) == float) and (type(fy) == int or type(fy) == float)), "Arguments 'fx' and 'fy' must be of type int or float."
+        
+        assert (fx > 0 and fy > 0), "Arguments 'fx' and 'fy' must be greater than 0"
+        
+        assert (type(keep_resolution) == bool), "Argument 'keep_resolution' can only be True or False."
+        
+        assert not (keep_resolution == True and (fx < 1 or fy < 1)), "'keep_resolution' can only be True when fx,fy >= 1."
+        
+        return self._add(lambda shape: _scale_pixels(*_scale_matrix(shape, fx, fy, keep_resolution), fx, fy), cv2.BORDER_REPLICATE)
+    
+    def shear(self, shear_val, axis = 0):
+        '''Adds shearing along the given axis. Arguments are same as 'shear'.'''
+        
+        assert (type(shear_val) == int or type(shear_val) == float), "Argument 'shear_val' must be of type int or float."
+        
+        assert (axis == 0 or axis == 1), "Value of argument 'axis' must be either 0 or 1."
+        
+        M = _shear_matrix(shear_val, axis)
+        return self._add(lambda shape: (M, (shape[1], shape[0])))
+    
+    def translate(self, tx, ty):
+        '''Adds translation by 'tx' and 'ty'. Arguments are same as 'translate'.'''
+        
+        assert ((type(tx) == int or type(tx) == float) and (type(ty) == int or type(ty) == float)), "Arguments 'tx' and 'tx' must be of type int or float."
+        
+        M = _translate_matrix(tx, ty)
+        return self._add(lambda shape: (M, (shape[1], shape[0])))
+    
+    def _add(self, op, border = cv2.BORDER_CONSTANT):
+        self.ops.append(op)
+        self.borders.append(border)
+        self._cache.clear()
+        return self
+    
+    def border(self):
+        '''Returns the border mode of the warp - replicated edges, as
+        'scale' gives, if the pipeline only scales, else constant.'''
+        
+        if self.borders and all(border == cv2.BORDER_REPLICATE for border in self.borders):
+            return cv2.BORDER_REPLICATE
+        return cv2.BORDER_CONSTANT
+    
+    def matrix(self, shape, pixels = False):
+        '''Returns the combined 3x3 matrix of all the operations and
+        the output size (w, h) for an image of the given shape. With
+        'pixels' True, returns the matrix the image is warped with,
+        in which scaling maps pixel centres like 'scale' does.'''
+        
+        key = tuple(shape[:2])
+        if key not in self._cache:
+            M_total, M_pixels_total, dsize = np.eye(3), np.eye(3), (key[1], key[0])
+            for op in self.ops:
+                result = op((dsize[1], dsize[0]))
+                M, dsize = result[:2]
+                M_pixels = result[2] if len(result) > 2 else M
+                M_total = np.vstack([M, [0, 0, 1]]) @ M_total
+                M_pixels_total = np.vstack([M_pixels, [0, 0, 1]]) @ M_pixels_total
+            self._cache[key] = (M_total, M_pixels_total, dsize)
+        M_total, M_pixels_total, dsize = self._cache[key]
+        return (M_pixels_total if pixels else M_total), dsize
+    
+    def __call__(self, img, box = None, out = None, inplace = False, masks = None, keypoints = None, polygons = None):
+        '''Returns image transformed by all the operations of the pipeline.
+        If box coordinates are passed, new bounding box coordinates
+        are calculated and returned in the same way as the geometric
+        functions, as are masks, keypoints and polygons. Result is
+        written into 'out' array, or into 'img' itself if inplace
+        is True.'''
         
-        assert (type(box) == list and len(box) == 4), "Argument 'box' must be of type list and must have a lenght of four."
+        _check_targets(img, masks, keypoints, polygons)
         
-        assert (box[0] < box[2] and box[1] < box[3]), "Top-left coordinates of bounding box must be smaller than bottom-right coordinates."
+        M, dsize = self.matrix(img.shape)
+        M_pixels = self.matrix(img.shape, pixels = True)[0]
+        out = _check_out(img, out, inplace, _out_shape(img, dsize))
+        targets, polygons_new = _warp_targets(M[:2], dsize, None, keypoints, polygons)
+        if masks is not None:
+            targets.insert(0, _warp_masks(masks, M_pixels[:2], dsize))
+        img_new = _warp(img, M_pixels[:2], dsize, 'pipeline', out, self.border())
         
-        box_new = []
-        box_new.append(min(max(0, box[0] + tx), img_new.shape[1]-1))
-        box_new.append(min(max(0, box[1] + ty), img_new.shape[0]-1))
-        box_new.append(min(max(0, box[2] + tx), img_new.shape[1]-1))
-        box_new.append(min(max(0, box[3] + ty), img_new.shape[0]-1))
+        if box is None:
+            return _with_targets(img_new, targets)
         
-        if (box_new[0] == box_new[2]) or (box_new[1] == box_new[3]):
-            box_new = [0,0,0,0]
+        boxes = _check_boxes(box)
+        boxes_new, degenerate = _clip_boxes(_target_boxes(M[:2], boxes, polygons_new), img_new.shape)
         
-        return img_new, box_new
\ No newline at end of file
+        return _with_targets(_return_boxes(img_new, box, boxes_new, degenerate), targets)
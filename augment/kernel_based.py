@@ -1,12 +1,15 @@
 import cv2
 import numpy as np
-import random
+from ._common import _check_out, _copy_into, _get_rng
+from .profiling import instrument
 
 
-def blur(img, blur_type = 'avg', ksize = (5, 5), median_ksize = 5, gaussian_sigma = 0):
+@instrument
+def blur(img, blur_type = 'avg', ksize = (5, 5), median_ksize = 5, gaussian_sigma = 0, out = None, inplace = False):
     '''Blur the passed image. Four different types of
     blurring can be performed - Average, Gaussian,
-    Median and bilateral.'''
+    Median and bilateral. Result is written into 'out'
+    array, or into 'img' itself if inplace is True.'''
     
     assert blur_type in ['avg', 'gaussian', 'median'], "Argument 'blur_type' can only have one of these three vales - 'avg', 'gaussian', 'median'."
     
@@ -16,88 +19,283 @@ def blur(img, blur_type = 'avg', ksize = (5, 5), median_ksize = 5, gaussian_sigm
     
     assert (type(gaussian_sigma) == int or type(gaussian_sigma) == float), "Argument 'gaussian_sigma' must be of type int or float."
     
-    img_new = img.copy()
+    out = _check_out(img, out, inplace)
     
     if blur_type == 'avg':
-        img_new = cv2.blur(img_new, ksize)
+        img_new = cv2.blur(img, ksize, dst = out)
         
     elif blur_type == 'gaussian':
-        img_new = cv2.GaussianBlur(img_new, ksize, gaussian_sigma)
+        img_new = cv2.GaussianBlur(img, ksize, gaussian_sigma, dst = out)
             
     elif blur_type == 'median':
-        img_new = cv2.medianBlur(img_new, median_ksize)
+        img_new = cv2.medianBlur(img, median_ksize, dst = out)
     
     return img_new
 
 
-def randomErase(img, size, box = None):
-    '''Replace random rectangular region from the passed
-    image with image mean. If box coordinates are passed,
-    random region is choosen from inside the bounding box.'''
+def _regions(img, size, box, count, rng):
+    '''Draws 'count' top-left corners of regions of 'size' for the whole
+    image, or 'count' per box inside each of the boxes, in one vectorized
+    call. Returns an array of shape (K, 2) with (x, y) values.'''
     
-    assert type(size) == tuple and (type(size[0]) == int and type(size[1]) == int), "Argument 'size' can only be of type tuple and values inside 'size' must be of type int."
+    h, w = img.shape[:2]
     
-    assert (size[0] < img.shape[1] and size[1] < img.shape[0]), "Values inside 'size' must be smaller then image dimensions."
+    if box is None:
+        x = rng.integers(0, w - size[0], count)
+        y = rng.integers(0, h - size[1], count)
+        return np.stack([x, y], axis = 1)
     
-    img_new = img.copy()
-    pixels_mean = int(img_new[:,:].mean())
+    boxes = np.array(box, ndmin = 2).astype(np.int64)
     
-    if box == None:
-        x = random.randint(0, img.shape[1] - (size[0] + 1))
-        y = random.randint(0, img.shape[0] - (size[1] + 1))
-        img_new[y : y + size[1], x : x + size[0]] = pixels_mean
-        
-    else:
-        assert (size[0] + box[2]) < img.shape[1] and (size[1] + box[3]) < img.shape[0], "Values passed inside 'size' are too big for the image. Either reduce the values inside 'size' argument or try 'randomErase' without passing 'box' argument."
-        
-        x = random.randint(box[0], box[2])
-        y = random.randint(box[1], box[3])
-        img_new[y : y + size[1], x : x + size[0]] = pixels_mean
+    assert boxes.ndim == 2 and boxes.shape[1] == 4, "Argument 'box' must be a list of length four or a numpy.ndarray of shape (N, 4)."
     
-    return img_new
+    assert np.all(boxes[:, 2] + size[0] < w) and np.all(boxes[:, 3] + size[1] < h), "Values passed inside 'size' are too big for the image. Either reduce the values inside 'size' argument or try without passing 'box' argument."
+    
+    boxes = np.repeat(boxes, count, axis = 0)
+    x = rng.integers(boxes[:, 0], boxes[:, 2] + 1)
+    y = rng.integers(boxes[:, 1], boxes[:, 3] + 1)
+    return np.stack([x, y], axis = 1)
 
 
-def randomCropAdd(img, size, box = None):
-    '''Random rectangular region is cropped and pasted at another
-    location. If box coordinates are passed, rectangular region is
-    cropped and pasted from inside the bounding box.'''
+def _check_regions(img, size, box, count, rects):
+    '''Validates 'size', 'box', 'count' and 'rects' arguments.'''
+    
+    assert type(count) == int and count > 0, "Argument 'count' must be a positive int."
+    
+    if rects is not None:
+        assert box is None and count == 1, "Arguments 'box' and 'count' can not be used together with 'rects'."
+        
+        assert (type(rects) == np.ndarray and rects.ndim == 2 and rects.shape[1] == 4), "Argument 'rects' must be a numpy.ndarray of shape (K, 4)."
+        
+        assert np.all(rects >= 0) and np.all(rects[:, :2] < rects[:, 2:]), "Rectangles in 'rects' must have non-negative coordinates in the format - (x1, y1, x2, y2)."
+        
+        return
     
     assert type(size) == tuple and (type(size[0]) == int and type(size[1]) == int), "Argument 'size' can only be of type tuple and values inside 'size' must be of type int."
     
     assert (size[0] < img.shape[1] and size[1] < img.shape[0]), "Values inside 'size' must be smaller then image dimensions."
+
+
+@instrument
+def randomErase(img, size, box = None, count = 1, rects = None, per_channel = False, rng = None, out = None, inplace = False):
+    '''Replace random rectangular regions from the passed
+    image with image mean. 'count' regions of 'size' are
+    drawn at once, or the rectangles are passed as 'rects'
+    of shape (K, 4). If box coordinates are passed, random
+    regions are choosen from inside every bounding box.
+    Mean is computed once, per channel if 'per_channel' is
+    True. Result is written into 'out' array, or into 'img'
+    itself if inplace is True.'''
     
-    img_new = img.copy()
+    _check_regions(img, size, box, count, rects)
     
-    if box == None:
-        x_old = random.randint(0, img.shape[1] - (size[0] + 1))
-        y_old = random.randint(0, img.shape[0] - (size[0] + 1))
-        x_new = random.randint(0, img.shape[1] - (size[0] + 1))
-        y_new = random.randint(0, img.shape[0] - (size[0] + 1))
-        img_new[y_old : y_old + size[1], x_old : x_old + size[0]] = img_new[
-            y_new : y_new + size[1], x_new : x_new + size[0]]
-        
+    rng = _get_rng(rng)
+    means = img.reshape(-1, img.shape[2] if img.ndim == 3 else 1).mean(axis = 0)
+    pixels_mean = means.astype(img.dtype) if per_channel == True else int(means.mean())
+    
+    if rects is None:
+        corners = _regions(img, size, box, count, rng)
+        rects = np.concatenate([corners, corners + size], axis = 1)
+    
+    img_new = _copy_into(img, _check_out(img, out, inplace))
+    
+    for x1, y1, x2, y2 in rects.astype(np.int64).tolist():
+        img_new[y1 : y2, x1 : x2] = pixels_mean
+    
+    return img_new
+
+
+@instrument
+def randomCropAdd(img, size, box = None, count = 1, rects = None, rng = None, out = None, inplace = False):
+    '''Random rectangular regions are cropped and pasted at other
+    locations. 'count' pairs of regions of 'size' are drawn at once,
+    or the regions to paste over are passed as 'rects' of shape
+    (K, 4) and every one gets a crop of its size from a random
+    location. If box coordinates are passed, rectangular regions are
+    cropped and pasted from inside every bounding box. Regions are
+    copied from the passed image. Result is written into 'out' array,
+    or into 'img' itself if inplace is True.'''
+    
+    _check_regions(img, size, box, count, rects)
+    
+    rng = _get_rng(rng)
+    h, w = img.shape[:2]
+    
+    if rects is None:
+        old = _regions(img, size, box, count, rng)
+        old = np.concatenate([old, old + size], axis = 1)
+        new = _regions(img, size, box, count, rng)
     else:
-        assert (size[0] + box[2]) < img.shape[1] and (size[1] + box[3]) < img.shape[0], "Values passed inside 'size' are too big for the image. Either reduce the values inside 'size' argument or try 'randomErase' without passing 'box' argument."
+        old = rects.astype(np.int64)
+        sizes = old[:, 2:] - old[:, :2]
+        
+        assert np.all(old[:, 2] <= w) and np.all(old[:, 3] <= h) and np.all(sizes[:, 0] < w) and np.all(sizes[:, 1] < h), "Rectangles in 'rects' must lie inside the image and be smaller then image dimensions."
         
-        x_old = random.randint(box[0], box[2])
-        y_old = random.randint(box[1], box[3])
-        x_new = random.randint(box[0], box[2])
-        y_new = random.randint(box[1], box[3])
-        img_new[y_old : y_old + size[1], x_old : x_old + size[0]] = img_new[
-            y_new : y_new + size[1], x_new : x_new + size[0]]
+        new = np.stack([rng.integers(0, w - sizes[:, 0]), rng.integers(0, h - sizes[:, 1])], axis = 1)
+    
+    img_new = _copy_into(img, _check_out(img, out, inplace))
+    
+    patches = [img[y : y + y2 - y1, x : x + x2 - x1] for (x, y), (x1, y1, x2, y2) in zip(new.tolist(), old.tolist())]
+    if np.shares_memory(img_new, img):
+        # Written in place - all patches are read before any is pasted,
+        # so later pastes do not copy regions changed by earlier ones.
+        patches = [patch.copy() for patch in patches]
+    
+    for (x1, y1, x2, y2), patch in zip(old.tolist(), patches):
+        img_new[y1 : y2, x1 : x2] = patch
     
     return img_new
 
 
-def sharpen(img):
+@instrument
+def sharpen(img, out = None, inplace = False):
     '''Sharpens the features of image
-    with a 3*3 filter.'''
+    with a 3*3 filter. Result is written
+    into 'out' array, or into 'img' itself
+    if inplace is True.'''
     
-    img_new = img.copy()
+    out = _check_out(img, out, inplace)
     
     kernel = np.array([[-1, -1, -1], 
                    [-1, 9,-1], 
                    [-1, -1, -1]])
-    img_new = cv2.filter2D(img_new, -1, kernel)
+    img_new = cv2.filter2D(img, -1, kernel, dst = out)
+    
+    return img_new
+
+
+def _gaussian_sigma(ksize, sigma):
+    '''Returns the (x, y) sigmas OpenCV uses for a Gaussian kernel.'''
+    
+    if sigma > 0:
+        return sigma, sigma
+    return tuple(0.3 * ((k - 1) * 0.5 - 1) + 0.8 for k in ksize)
+
+
+class FilterBank:
+    '''Set of kernel-based variants of one image, produced in a
+    single call. Identical filters are computed once, and wider
+    Gaussian blurs are cascaded from narrower ones when the
+    remaining kernel is smaller than the direct one - blurring
+    with sigma s1 and then with sqrt(s2**2 - s1**2) equals
+    blurring with s2. Cascaded results can differ from 'blur'
+    by one intensity level; pass cascade = False for exact ones.
+    
+    Average blurs use OpenCV's running-sum box filter, whose cost
+    does not depend on the kernel size, and sharpen uses the same
+    3*3 filter as 'sharpen'.
+    
+    Example:
+        bank = FilterBank().blur('gaussian', ksize = (5, 5)).blur('gaussian', ksize = (31, 31)).blur('avg', ksize = (51, 51)).sharpen()
+        outputs = bank(img)
+        outputs = bank(img2, out = outputs)     # reuses the output arrays'''
+    
+    def __init__(self, cascade = True):
+        assert type(cascade) == bool, "Argument 'cascade' can only be True or False."
+        
+        self.cascade = cascade
+        self.filters = []
+    
+    def blur(self, blur_type = 'avg', ksize = (5, 5), median_ksize = 5, gaussian_sigma = 0):
+        '''Adds a blur. Arguments are same as 'blur'.'''
+        
+        assert blur_type in ['avg', 'gaussian', 'median'], "Argument 'blur_type' can only have one of these three vales - 'avg', 'gaussian', 'median'."
+        
+        assert type(ksize) == tuple and len(ksize) == 2 and (ksize[0] > 0 and ksize[0] % 2 != 0) and (ksize[1] > 0 and ksize[1] % 2 != 0), "Argument 'ksize' can only be of type tuple with length equal to two and 'ksize' values must be odd positive integers."
+        
+        assert type(median_ksize) == int and median_ksize > 0 and median_ksize % 2 != 0, "Argument 'median_ksize' can only be of type int and must be an odd positive integer."
+        
+        assert (type(gaussian_sigma) == int or type(gaussian_sigma) == float) and gaussian_sigma >= 0, "Argument 'gaussian_sigma' must be of type int or float and must be greater than or equal to 0."
+        
+        if blur_type == 'avg':
+            self.filters.append(('avg', ksize))
+        elif blur_type == 'gaussian':
+            self.filters.append(('gaussian', ksize, gaussian_sigma))
+        else:
+            self.filters.append(('median', median_ksize))
+        return self
+    
+    def sharpen(self):
+        '''Adds sharpening with the filter of 'sharpen'.'''
+        
+        self.filters.append(('sharpen',))
+        return self
+    
+    def allocate(self, img):
+        '''Returns a list of output arrays for images like 'img'.'''
+        
+        return [np.empty_like(img) for _ in self.filters]
+    
+    def _plan(self):
+        '''Returns the order in which unique filters are computed and, for
+        every Gaussian, the Gaussian it is cascaded from (or None) with
+        the remaining sigmas and kernel size.'''
+        
+        unique = list(dict.fromkeys(self.filters))
+        gaussians = sorted((f for f in unique if f[0] == 'gaussian'), key = lambda f: _gaussian_sigma(f[1], f[2]))
+        sources = {}
+        
+        for i, f in enumerate(gaussians):
+            sx, sy = _gaussian_sigma(f[1], f[2])
+            sources[f] = None
+            if self.cascade == False:
+                continue
+            
+            for g in reversed(gaussians[:i]):
+                gx, gy = _gaussian_sigma(g[1], g[2])
+                if gx < sx and gy < sy:
+                    rx, ry = (sx**2 - gx**2)**0.5, (sy**2 - gy**2)**0.5
+                    ksize = (2 * int(np.ceil(3 * rx)) + 1, 2 * int(np.ceil(3 * ry)) + 1)
+                    if ksize[0] + ksize[1] < f[1][0] + f[1][1]:
+                        sources[f] = (g, (rx, ry), ksize)
+                    break
+        
+        return [f for f in unique if f[0] != 'gaussian'] + gaussians, sources
     
-    return img_new
\ No newline at end of file
+    def __call__(self, img, out = None):
+        '''Returns the list of filtered images, in the order the filters
+        were added. Results are written into the arrays of 'out' if
+        passed, e.g. the list returned by a previous call.'''
+        
+        if out is None:
+            out = self.allocate(img)
+        
+        assert (type(out) == list and len(out) == len(self.filters)), "Argument 'out' must be a list with one array per filter."
+        
+        for o in out:
+            _check_out(img, o)
+        
+        order, sources = self._plan()
+        
+        # Every unique filter is written into the first output asking for it.
+        target = {}
+        for f, o in zip(self.filters, out):
+            target.setdefault(f, o)
+        
+        for f in order:
+            dst = target[f]
+            
+            if f[0] == 'avg':
+                cv2.blur(img, f[1], dst = dst)
+            
+            elif f[0] == 'median':
+                cv2.medianBlur(img, f[1], dst = dst)
+            
+            elif f[0] == 'sharpen':
+                kernel = np.array([[-1, -1, -1],
+                                   [-1, 9, -1],
+                                   [-1, -1, -1]])
+                cv2.filter2D(img, -1, kernel, dst = dst)
+            
+            elif sources[f] is None:
+                cv2.GaussianBlur(img, f[1], f[2], dst = dst)
+            
+            else:
+                source, sigma, ksize = sources[f]
+                cv2.GaussianBlur(target[source], ksize, sigmaX = sigma[0], sigmaY = sigma[1], dst = dst)
+        
+        for f, o in zip(self.filters, out):
+            if o is not target[f]:
+                o[...] = target[f]
+        
+        return out
@@ -0,0 +1,205 @@
+'''Image loading which takes the planned operations into account.
+
+When the first planned operation is a downscale, JPEG images are decoded
+at 1/2, 1/4 or 1/8 of their resolution with OpenCV's reduced decoding,
+which is much cheaper than a full decode. The remaining scale factor and
+the boxes are adjusted, so the final output has the same size.
+
+Example:
+    loader = Loader()
+    img, boxes, ops = loader.load('image.jpg', ["scale(fx = 0.2, fy = 0.2)", "rotate(angle = 5)"], box = bboxes)
+    img, boxes = apply_ops(img, boxes, ops)
+    print(loader.stats())
+'''
+
+import inspect
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from . import geometric
+from .chain import parse_op
+
+
+_REDUCED_FLAGS = {
+    True: {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8},
+    False: {1: cv2.IMREAD_GRAYSCALE, 2: cv2.IMREAD_REDUCED_GRAYSCALE_2, 4: cv2.IMREAD_REDUCED_GRAYSCALE_4, 8: cv2.IMREAD_REDUCED_GRAYSCALE_8},
+}
+
+
+def jpeg_size(data):
+    '''Returns (w, h) read from the frame header of JPEG bytes, or None
+    if 'data' is not a JPEG image.'''
+
+    if data[:2] != b'\xff\xd8':
+        return None
+
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+
+        if marker == 0xFF:
+            i += 1
+        elif marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            i += 2
+        elif 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            h = int.from_bytes(data[i + 5 : i + 7], 'big')
+            w = int.from_bytes(data[i + 7 : i + 9], 'big')
+            return w, h
+        else:
+            i += 2 + int.from_bytes(data[i + 2 : i + 4], 'big')
+
+    return None
+
+
+def _scale_arguments(op):
+    '''Returns all arguments of 'op' by name, without the image, if it is
+    a scale without keep_resolution, else None.'''
+
+    name, args, kwargs = op
+    if name != 'scale':
+        return None
+
+    bound = inspect.signature(geometric.scale).bind_partial(None, *args, **kwargs).arguments
+    if bound.get('keep_resolution', False) or 'fx' not in bound or 'fy' not in bound:
+        return None
+    return {key: value for key, value in bound.items() if key != 'img'}
+
+
+def _scale_factors(op):
+    '''Returns (fx, fy) if 'op' is a scale without keep_resolution, else None.'''
+
+    bound = _scale_arguments(op)
+    return None if bound is None else (bound['fx'], bound['fy'])
+
+
+def reduction(ops):
+    '''Returns the largest JPEG reduction factor (1, 2, 4 or 8) which
+    loses no output quality for the planned operations - the first
+    operation must be a downscale that stays a downscale after the
+    reduced decode.'''
+
+    if not ops or callable(ops[0]):
+        return 1
+
+    factors = _scale_factors(ops[0])
+    if factors is None:
+        return 1
+
+    for r in (8, 4, 2):
+        if factors[0] * r <= 1 and factors[1] * r <= 1:
+            return r
+    return 1
+
+
+class Loader:
+    '''Loads images with reduced JPEG decoding where the planned operations
+    allow it, and keeps statistics of the decode time.
+
+    The saved time is estimated from the full-resolution decode speed
+    measured on images that were decoded at full size. If no such image
+    was loaded yet, the first reduced image is decoded once more at full
+    size to calibrate the estimate.'''
+
+    def __init__(self, reduce = True, color = True):
+        assert type(reduce) == bool, "Argument 'reduce' can only be True or False."
+
+        assert type(color) == bool, "Argument 'color' can only be True or False."
+
+        self.reduce = reduce
+        self.color = color
+        self._lock = threading.Lock()
+        self.images = 0
+        self.reduced = 0
+        self.decode_seconds = 0.0
+        self.saved_seconds = 0.0
+        self._full_seconds = 0.0
+        self._full_pixels = 0
+
+    def _decode(self, path, data, flags, out):
+        start = time.perf_counter()
+        img = None
+        if out is not None:
+            try:
+                # OpenCV >= 4.10 can decode straight into a preallocated image.
+                img = cv2.imread(path, out, flags)
+            except (TypeError, cv2.error):
+                img = None
+        if img is None or img.size == 0:
+            img = cv2.imdecode(np.frombuffer(data, dtype = np.uint8), flags)
+            if img is not None and out is not None:
+                assert out.shape == img.shape and out.dtype == img.dtype, "Argument 'out' must be a numpy.ndarray of shape {} and type {}.".format(img.shape, img.dtype)
+                out[...] = img
+                img = out
+        return img, time.perf_counter() - start
+
+    def load(self, path, ops = (), box = None, out = None):
+        '''Loads the image at 'path' for the planned operations. Returns the
+        image, the boxes adjusted to its resolution and the operations
+        still to apply (as parsed tuples). 'out' is an optional buffer of
+        the decoded shape which the image is decoded into.'''
+
+        ops = [parse_op(op) if type(op) == str else op for op in ops]
+
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        size = jpeg_size(data)
+        r = reduction(ops) if (self.reduce and size is not None) else 1
+
+        img, seconds = self._decode(path, data, _REDUCED_FLAGS[self.color][r], out)
+        if img is None:
+            raise IOError("Could not read image '{}'.".format(path))
+
+        saved = 0.0
+        if r == 1:
+            with self._lock:
+                self._full_seconds += seconds
+                self._full_pixels += img.shape[0] * img.shape[1]
+        else:
+            w, h = size
+            if img.shape[:2] != (-(-h // r), -(-w // r)):
+                # EXIF orientation swapped the axes.
+                w, h = h, w
+
+            fx, fy = _scale_factors(ops[0])
+            target = (int(round(w * fx)), int(round(h * fy)))
+            fx_new, fy_new = target[0] / img.shape[1], target[1] / img.shape[0]
+            # The remaining scale keeps every other argument of the planned one,
+            # it is only left out if it would do nothing.
+            kwargs = dict(_scale_arguments(ops[0]), fx = fx_new, fy = fy_new)
+            rest = ops[1:]
+            if (fx_new, fy_new) != (1, 1) or set(kwargs) - {'fx', 'fy', 'keep_resolution'}:
+                rest = [('scale', (), kwargs)] + rest
+            ops = rest
+
+            if box is not None:
+                factors = [img.shape[1] / w, img.shape[0] / h] * 2
+                box = (np.asarray(box) * factors) if type(box) == np.ndarray else [v * f for v, f in zip(box, factors)]
+
+            if self._full_pixels == 0:
+                _, full = self._decode(path, data, _REDUCED_FLAGS[self.color][1], None)
+                with self._lock:
+                    self._full_seconds += full
+                    self._full_pixels += w * h
+            saved = max(0.0, self._full_seconds / self._full_pixels * w * h - seconds)
+
+        with self._lock:
+            self.images += 1
+            self.reduced += r > 1
+            self.decode_seconds += seconds
+            self.saved_seconds += saved
+
+        return img, box, ops
+
+    def stats(self):
+        '''Returns number of loaded and reduced images, total decode time
+        and the estimated decode time saved, in seconds.'''
+
+        with self._lock:
+            return {'images': self.images, 'reduced': self.reduced,
+                    'decode_seconds': self.decode_seconds, 'saved_seconds': self.saved_seconds}
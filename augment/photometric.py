@@ -1,50 +1,287 @@
 import cv2
 import numpy as np
+from functools import lru_cache
+from ._common import _check_out, _copy_into, _get_rng
+from .profiling import instrument
 
 
-def brightness_contrast(img, alpha = 1.5, beta = 0):
+@lru_cache(maxsize = 256)
+def _lut(op, *params):
+    '''Returns the uint8 lookup table of a pointwise operation.
+    Tables are cached by operation and parameters, so repeated
+    calls with the same values only cost the lookup.'''
+    
+    x = np.arange(256, dtype = np.float64)
+    
+    if op == 'brightness_contrast':
+        alpha, beta = params
+        table = np.clip(x * alpha + beta, 0, 255)
+    
+    elif op == 'gamma':
+        table = np.clip(np.rint(255 * (x / 255) ** params[0]), 0, 255)
+    
+    elif op == 'invert':
+        table = 255 - x
+    
+    elif op == 'posterize':
+        table = np.bitwise_and(np.arange(256), 256 - 2 ** (8 - params[0]))
+    
+    elif op == 'hsv':
+        # One table per channel, shape (256, 1, 3) as 'cv2.LUT' expects.
+        # Hue of 8-bit HSV lies in 0 - 179 and is rotated modulo 180.
+        hue, saturation, value = params
+        table = np.stack([np.rint(np.minimum(x, 179) + hue) % 180,
+                          np.clip(np.rint(x * saturation), 0, 255),
+                          np.clip(np.rint(x * value), 0, 255)], axis = -1)[:, None]
+    
+    table = table.astype(np.uint8)
+    table.setflags(write = False)
+    return table
+
+
+def _check_uint8(img):
+    assert img.dtype == np.uint8, "Image must be of type numpy.uint8."
+
+
+@instrument
+def brightness_contrast(img, alpha = 1.5, beta = 0, out = None, inplace = False):
     '''Brightness and contrast of the passed image 
-    are modified using 'alpha' and 'beta' arguments.'''
+    are modified using 'alpha' and 'beta' arguments.
+    Result is written into 'out' array, or into 'img'
+    itself if inplace is True.'''
     
     assert (type(alpha) == int or type(alpha) == float) and (type(beta) == int or type(beta) == float), "Arguments 'alpha' and 'beta' must be of type int or float."
     
     assert alpha >= 0, "Argument 'alpha' must be greater than or equal to 0."
     
-    img_new = img.astype('int')
+    _check_uint8(img)
+    out = _check_out(img, out, inplace)
+    img_new = cv2.LUT(img, _lut('brightness_contrast', alpha, beta), dst = out)
+    
+    return img_new
+
+
+@instrument
+def gamma(img, gamma_val = 1.0, out = None, inplace = False):
+    '''Applies gamma correction to the passed image.
+    Values of 'gamma_val' below 1 brighten the image,
+    values above 1 darken it.
+    Result is written into 'out' array, or into 'img'
+    itself if inplace is True.'''
+    
+    assert (type(gamma_val) == int or type(gamma_val) == float) and gamma_val > 0, "Argument 'gamma_val' must be of type int or float and must be greater than 0."
     
-    img_new = img_new * alpha + beta
-    img_new[img_new > 255] = 255
-    img_new[img_new < 0] = 0
-    img_new = img_new.astype(np.uint8)
+    _check_uint8(img)
+    out = _check_out(img, out, inplace)
+    img_new = cv2.LUT(img, _lut('gamma', gamma_val), dst = out)
     
     return img_new
 
 
-def colorSpace(img, colorspace = 'hsv'):
+@instrument
+def invert(img, out = None, inplace = False):
+    '''Returns the negative of the passed image.
+    Result is written into 'out' array, or into 'img'
+    itself if inplace is True.'''
+    
+    _check_uint8(img)
+    out = _check_out(img, out, inplace)
+    img_new = cv2.LUT(img, _lut('invert'), dst = out)
+    
+    return img_new
+
+
+@instrument
+def posterize(img, bits = 4, out = None, inplace = False):
+    '''Reduces every channel of the passed image
+    to the given number of bits.
+    Result is written into 'out' array, or into 'img'
+    itself if inplace is True.'''
+    
+    assert type(bits) == int and bits >= 1 and bits <= 8, "Argument 'bits' must be of type int and must lie between 1 and 8."
+    
+    _check_uint8(img)
+    out = _check_out(img, out, inplace)
+    img_new = cv2.LUT(img, _lut('posterize', bits), dst = out)
+    
+    return img_new
+
+
+class LUTPipeline:
+    '''Chain of pointwise photometric operations merged into a
+    single uint8 lookup table. The image is processed in one pass
+    with 'cv2.LUT' no matter how many operations are chained.
+    
+    Arguments are validated when an operation is added to the
+    pipeline. Tables of the single operations are cached by their
+    parameters and the merged table is built only once.
+    
+    Example:
+        pipeline = LUTPipeline().brightness_contrast(1.3, 20).gamma(0.8).posterize(5)
+        img_new = pipeline(img)'''
+    
+    def __init__(self):
+        self.ops = []
+        self._table = None
+    
+    def brightness_contrast(self, alpha = 1.5, beta = 0):
+        '''Adds brightness and contrast change. Arguments are same as 'brightness_contrast'.'''
+        
+        assert (type(alpha) == int or type(alpha) == float) and (type(beta) == int or type(beta) == float), "Arguments 'alpha' and 'beta' must be of type int or float."
+        
+        assert alpha >= 0, "Argument 'alpha' must be greater than or equal to 0."
+        
+        return self._add('brightness_contrast', alpha, beta)
+    
+    def gamma(self, gamma_val = 1.0):
+        '''Adds gamma correction. Arguments are same as 'gamma'.'''
+        
+        assert (type(gamma_val) == int or type(gamma_val) == float) and gamma_val > 0, "Argument 'gamma_val' must be of type int or float and must be greater than 0."
+        
+        return self._add('gamma', gamma_val)
+    
+    def invert(self):
+        '''Adds inversion of the image.'''
+        
+        return self._add('invert')
+    
+    def posterize(self, bits = 4):
+        '''Adds posterization. Arguments are same as 'posterize'.'''
+        
+        assert type(bits) == int and bits >= 1 and bits <= 8, "Argument 'bits' must be of type int and must lie between 1 and 8."
+        
+        return self._add('posterize', bits)
+    
+    def _add(self, op, *params):
+        self.ops.append((op,) + params)
+        self._table = None
+        return self
+    
+    def table(self):
+        '''Returns the merged uint8 lookup table of all the operations.'''
+        
+        if self._table is None:
+            table = np.arange(256, dtype = np.uint8)
+            for op in self.ops:
+                table = _lut(*op)[table]
+            self._table = table
+        return self._table
+    
+    def __call__(self, img, out = None, inplace = False):
+        '''Returns image transformed by all the operations of the pipeline.
+        Result is written into 'out' array, or into 'img' itself if
+        inplace is True.'''
+        
+        _check_uint8(img)
+        out = _check_out(img, out, inplace)
+        return cv2.LUT(img, self.table(), dst = out)
+
+
+@instrument
+def colorSpace(img, colorspace = 'hsv', out = None, inplace = False):
     '''Change the colorspace of given image to
-    the provided 'colorspace' argument.'''
+    the provided 'colorspace' argument.
+    Result is written into 'out' array, or into 'img'
+    itself if inplace is True.'''
     
     assert type(colorspace) == str, "Argument 'colorspace' must be of type str."
     
     assert colorspace in (['hsv', 'ycrcb', 'lab']), "Wrong choice of argument 'colorspace'. Argument 'colorspace' can only be one of the following types - 'hsv', 'ycrcb' 'lab'."
     
-    img_new = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
+    out = _check_out(img, out, inplace)
     
+    # Images are in BGR order as read by 'cv2.imread', so a single
+    # conversion from BGR is enough.
     if colorspace == 'hsv':
-        img_new = cv2.cvtColor(img_new, cv2.COLOR_RGB2HSV)
+        img_new = cv2.cvtColor(img, cv2.COLOR_BGR2HSV, dst = out)
     
     elif colorspace == 'ycrcb':
-        img_new = cv2.cvtColor(img_new, cv2.COLOR_RGB2YCrCb)
+        img_new = cv2.cvtColor(img, cv2.COLOR_BGR2YCrCb, dst = out)
     
     elif colorspace == 'lab':
-        img_new = cv2.cvtColor(img_new, cv2.COLOR_RGB2Lab)
+        img_new = cv2.cvtColor(img, cv2.COLOR_BGR2Lab, dst = out)
         
     return img_new
 
 
-def addNoise(img, noise_type = 'gaussian', mean = 0, var = 0.05, sp_ratio = 0.5, noise_amount = 0.02):
+@instrument
+def color_jitter(img, hue = 0, saturation = 1.0, value = 1.0, out = None, inplace = False):
+    '''Rotates the hue of the passed BGR image by 'hue' (in
+    OpenCV units, 0 - 179 covers the full circle) and scales
+    its saturation and value. The image is converted to HSV
+    once, all three channels go through one lookup table
+    and it is converted back once. A batch of shape
+    (N, h, w, 3) is processed as one image, sharing the tables.
+    Result is written into 'out' array, or into 'img'
+    itself if inplace is True.'''
+    
+    assert (type(hue) == int or type(hue) == float), "Argument 'hue' must be of type int or float."
+    
+    assert (type(saturation) == int or type(saturation) == float) and saturation >= 0, "Argument 'saturation' must be of type int or float and must be greater than or equal to 0."
+    
+    assert (type(value) == int or type(value) == float) and value >= 0, "Argument 'value' must be of type int or float and must be greater than or equal to 0."
+    
+    assert img.ndim in (3, 4) and img.shape[-1] == 3, "Image must have three channels (BGR), or be a batch of shape (N, h, w, 3)."
+    
+    _check_uint8(img)
+    out = _check_out(img, out, inplace)
+    img_new = np.empty_like(img) if out is None else out
+    
+    # All steps run in the output buffer, without temporary images.
+    src, dst = img.reshape(-1, *img.shape[-2:]), img_new.reshape(-1, *img.shape[-2:])
+    cv2.cvtColor(src, cv2.COLOR_BGR2HSV, dst = dst)
+    cv2.LUT(dst, _lut('hsv', hue % 180, saturation, value), dst = dst)
+    cv2.cvtColor(dst, cv2.COLOR_HSV2BGR, dst = dst)
+    
+    return img_new
+
+
+class NoiseBank:
+    '''Precomputed field of standard normal noise. Gaussian noise
+    for an image is served as a random crop of the cached field,
+    so no fresh normals have to be drawn for every frame.
+    
+    Example:
+        bank = NoiseBank(size = (2048, 2048), channels = 3, rng = 0)
+        img_new = addNoise(img, 'gaussian', var = 0.01, noise_bank = bank)'''
+    
+    def __init__(self, size = (1024, 1024), channels = 3, rng = None):
+        assert type(size) == tuple and len(size) == 2 and size[0] > 0 and size[1] > 0, "Argument 'size' must be of type tuple with two positive values - (height, width)."
+        
+        assert type(channels) == int and channels > 0, "Argument 'channels' must be a positive int."
+        
+        self.rng = _get_rng(rng)
+        self.field = self.rng.standard_normal(size + (channels,), dtype = np.float32)
+    
+    def sample(self, shape, rng = None):
+        '''Returns a read-only view of the noise field with the given
+        image shape, taken at a random offset.'''
+        
+        h, w = shape[:2]
+        c = shape[2] if len(shape) == 3 else 1
+        
+        assert h <= self.field.shape[0] and w <= self.field.shape[1] and c <= self.field.shape[2], "Image is larger than the noise bank."
+        
+        rng = self.rng if rng is None else _get_rng(rng)
+        y = rng.integers(0, self.field.shape[0] - h + 1)
+        x = rng.integers(0, self.field.shape[1] - w + 1)
+        noise = self.field[y : y + h, x : x + w, :c]
+        
+        if len(shape) == 2:
+            noise = noise[:, :, 0]
+        
+        noise.setflags(write = False)
+        return noise
+
+
+@instrument
+def addNoise(img, noise_type = 'gaussian', mean = 0, var = 0.05, sp_ratio = 0.5, noise_amount = 0.02, rng = None, noise_bank = None, out = None, inplace = False):
     '''Add noise to the passed image. gaussian, salt n pepper
-    and poisson are the types of noises that are supported.'''
+    and poisson are the types of noises that are supported.
+    Noise is drawn from 'rng' generator if passed, gaussian
+    noise can also be served from a precomputed 'noise_bank'.
+    Result is written into 'out' array, or into 'img'
+    itself if inplace is True.'''
     
     assert noise_type in ['gaussian', 'salt_pepper', 'poisson'], "Wrong choice of argument 'noise_type'. Argument 'noise_type' can only be one of the following types - 'gaussian', 'salt_pepper' 'poisson'."
     
@@ -56,31 +293,50 @@ def addNoise(img, noise_type = 'gaussian', mean = 0, var = 0.05, sp_ratio = 0.5,
     
     assert (type(noise_amount) == int or type(noise_amount) == float) and noise_amount > 0, "Argument 'noise_amount' must be of type int or float and value of 'noise_amount' must be greater than zero"
     
-    img_new = img.copy()
-    img_new = img_new/255
+    assert noise_bank is None or (isinstance(noise_bank, NoiseBank) and noise_type == 'gaussian'), "Argument 'noise_bank' must be a NoiseBank and can only be used with noise_type = 'gaussian'."
     
-    if noise_type == 'gaussian':
-        sigma = var**0.5
-        gauss = np.random.normal(mean, sigma, (img_new.shape[:]))
-        img_new = img_new + gauss
+    _check_uint8(img)
+    out = _check_out(img, out, inplace)
+    rng = _get_rng(rng)
+    
+    if noise_type == 'salt_pepper':
+        # Salt and pepper pixels are written straight into the uint8 copy.
+        img_new = _copy_into(img, out)
         
-    elif noise_type == 'salt_pepper':
         # Salt mode
         num_salt = int(noise_amount * img_new.size * sp_ratio)
-        coords = [np.random.randint(0, i - 1, num_salt) for i in img_new.shape[:2]]
-        img_new[coords[0], coords[1]] = 1
+        coords = [rng.integers(0, i, num_salt) for i in img_new.shape[:2]]
+        img_new[coords[0], coords[1]] = 255
 
         # Pepper mode
         num_pepper = int(noise_amount * img_new.size * (1. - sp_ratio))
-        coords = [np.random.randint(0, i - 1, num_pepper) for i in img_new.shape[:2]]
+        coords = [rng.integers(0, i, num_pepper) for i in img_new.shape[:2]]
         img_new[coords[0], coords[1]] = 0
         
+        return img_new
+    
+    # Noise is computed in a single float32 buffer on the 0-255 scale.
+    if noise_type == 'gaussian':
+        if noise_bank is None:
+            noise = rng.standard_normal(img.shape, dtype = np.float32)
+        else:
+            noise = noise_bank.sample(img.shape, rng).copy()
+        noise *= var**0.5 * 255
+        noise += mean * 255
+        
     elif noise_type == 'poisson':
-        img_new = img_new + (np.random.poisson(img_new * noise_amount) / float(noise_amount))
+        noise = img.astype(np.float32)
+        noise *= noise_amount / 255
+        noise[...] = rng.poisson(noise)
+        noise *= 255 / noise_amount
     
-    img_new = img_new * 255
-    img_new[img_new > 255] = 255
-    img_new[img_new < 0] = 0
-    img_new = img_new.astype(np.uint8)
+    noise += img
+    np.clip(noise, 0, 255, out = noise)
     
-    return img_new
\ No newline at end of file
+    if out is None:
+        img_new = noise.astype(np.uint8)
+    else:
+        img_new = out
+        img_new[...] = noise
+    
+    return img_new
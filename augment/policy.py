@@ -0,0 +1,530 @@
+'''Augmentation policies and a planner for chains of operations.
+
+The cost of a chain depends on its order - a crop placed before a blur
+means the blur touches far fewer pixels - and on how many passes it
+makes over the image. A Plan reorders and fuses a chain: size-reducing
+operations (crop, downscaling scale, random_resized_crop) are moved
+before the operations they commute with and adjacent brightness_contrast,
+gamma, invert and posterize are merged into one LUTPipeline table. With
+the default commute = 'exact' the result is the same as running the
+chain as written. With commute = 'approximate' more operations are
+swapped and adjacent rotate, scale, shear and translate are fused into
+one AffinePipeline warp, which is close but not identical - content and
+boxes are no longer clipped between the fused warps. 'explain' prints
+the stages with the pixels every stage touches and its cost, estimated
+from per-pixel rates measured on this machine.
+
+A Policy samples RandAugment-style chains - 'n' operations drawn from
+the three augmentation modules at a shared 'magnitude' - and runs every
+sampled chain through the planner.
+
+Example:
+    plan = Plan(["blur('gaussian', ksize = (5, 5))", "gamma(0.8)", "invert()", "crop((0, 0), (511, 511))"], commute = 'approximate')
+    print(plan.explain((1080, 1920, 3)))
+    img_new, boxes_new = plan(img, boxes)
+
+    policy = Policy(n = 2, magnitude = 9, pre = ["random_resized_crop(size = (224, 224))"], rng = 0)
+    img_new, boxes_new = policy(img, boxes)
+'''
+
+import inspect
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from . import geometric
+from ._common import _get_rng
+from .chain import OPS, _transform_boxes, apply_ops, parse_op
+from .geometric import AffinePipeline
+from .photometric import LUTPipeline
+
+
+LUT_OPS = ('brightness_contrast', 'gamma', 'invert', 'posterize')
+AFFINE_OPS = ('rotate', 'scale', 'shear', 'translate')
+COMMUTE = ('none', 'exact', 'approximate')
+
+
+def _arguments(op):
+    '''Returns all arguments of a parsed operation by name, defaults included.'''
+
+    name, args, kwargs = op
+    bound = inspect.signature(OPS[name]).bind(None, *args, **kwargs)
+    bound.apply_defaults()
+    return bound.arguments
+
+
+def _format(op):
+    '''Returns an operation written as a python call.'''
+
+    if callable(op):
+        return getattr(op, '__name__', type(op).__name__)
+
+    name, args, kwargs = op
+    return '{}({})'.format(name, ', '.join([repr(a) for a in args] + ['{} = {!r}'.format(k, v) for k, v in kwargs.items()]))
+
+
+def _format_shape(shape):
+    return 'x'.join(str(s) for s in shape)
+
+
+def _pixels(shape):
+    return shape[0] * shape[1]
+
+
+def _output_shape(op, shape):
+    '''Returns the shape of the result of a single operation.'''
+
+    if callable(op) or op[0] not in ('crop', 'random_resized_crop', 'rotate', 'scale'):
+        return tuple(shape)
+
+    name, a = op[0], _arguments(op)
+    if name == 'crop':
+        return (a['point2'][1] - a['point1'][1], a['point2'][0] - a['point1'][0]) + tuple(shape[2:])
+
+    if name == 'random_resized_crop':
+        return (a['size'][1], a['size'][0]) + tuple(shape[2:])
+
+    if name == 'rotate':
+        dsize = geometric._rotation_matrix(shape, a['angle'], a['keep_resolution'])[1]
+    else:
+        keep_resolution = a['keep_resolution'] and a['fx'] >= 1 and a['fy'] >= 1
+        dsize = geometric._scale_matrix(shape, a['fx'], a['fy'], keep_resolution)[1]
+    return (dsize[1], dsize[0]) + tuple(shape[2:])
+
+
+def _commutes(left, right, commute):
+    '''Returns True if the size-reducing operation 'right' can be moved
+    before 'left', and whether the result is identical.
+
+    Per-pixel operations give identical results on a crop. Across a
+    resize, interpolation and the nonlinear tables no longer commute
+    exactly. Noise and kernels commute with a crop only approximately -
+    noise keeps its distribution but not its values and kernels differ
+    within their radius of the crop border. Nothing is moved across a
+    geometric or random region operation, whose coordinates are in
+    pixels of the current image, or across a callable.'''
+
+    if commute == 'none' or callable(left):
+        return False, False
+
+    name, crop = left[0], right[0] == 'crop'
+    if name in LUT_OPS or name == 'color_jitter':
+        return crop or commute == 'approximate', crop
+
+    if name == 'colorSpace':
+        # Interpolating hue wraps around, so a resize is never moved.
+        return crop, crop
+
+    if name in ('addNoise', 'blur', 'sharpen'):
+        return crop and commute == 'approximate', False
+
+    return False, False
+
+
+def _fuse(pipeline, ops):
+    '''Adds parsed operations to an AffinePipeline or LUTPipeline.'''
+
+    for op in ops:
+        a = _arguments(op)
+        method = getattr(pipeline, op[0])
+        params = {k: a[k] for k in list(inspect.signature(method).parameters)}
+        if op[0] == 'scale':
+            # Same fallback as 'scale' - zooming out can not keep the resolution.
+            params['keep_resolution'] = a['keep_resolution'] and a['fx'] >= 1 and a['fy'] >= 1
+        method(**params)
+    return pipeline
+
+
+class Plan:
+    '''Reordered and fused form of a chain of operations, given as
+    strings, parsed (name, args, kwargs) tuples or callables taking and
+    returning (img, boxes) like 'apply_ops'. Calling the plan with
+    (img, boxes) returns (img, boxes), so a plan can itself be passed
+    to 'apply_ops' or AugmentStream as an operation.
+
+    'commute' sets which operations may be swapped to move size-reducing
+    operations earlier - 'exact' only swaps per-pixel operations with
+    crops, which gives identical results, 'approximate' also swaps them
+    with downscales (up to interpolation rounding) and swaps crops with
+    noise and kernels (differences within the kernel radius of the crop
+    border), 'none' keeps the order. With 'approximate', pointwise
+    tables which keep black pixels black are also moved after adjacent
+    warps, so the warps fuse into one.
+
+    With 'fuse' and commute = 'approximate', runs of two or more affine
+    operations are warped once, as AffinePipeline does - image content
+    and boxes are not clipped between the fused operations, so this is
+    not exact. Runs of lookup table operations are always merged, which
+    is exact.
+
+    Stages depend on the image size, as it decides whether
+    random_resized_crop reduces the image, and are cached per shape.'''
+
+    def __init__(self, ops, commute = 'exact', fuse = True):
+        assert commute in COMMUTE, "Argument 'commute' can only be one of - {}.".format(', '.join(COMMUTE))
+
+        assert type(fuse) == bool, "Argument 'fuse' can only be True or False."
+
+        self.ops = [parse_op(op) if type(op) == str else op for op in ops]
+        for op in self.ops:
+            if callable(op):
+                continue
+            try:
+                _arguments(op)
+            except TypeError as e:
+                raise ValueError("Arguments of operation '{}' do not match - {}.".format(_format(op), e))
+
+        self.commute = commute
+        self.fuse = fuse
+        self._cache = {}
+
+    def _reorder(self, shape):
+        '''Returns the reordered operations and notes on every move.'''
+
+        ops, notes = list(self.ops), []
+        shapes = [tuple(shape)]
+        for op in ops:
+            shapes.append(_output_shape(op, shapes[-1]))
+
+        # Every size-reducing operation moves left past the operations
+        # it commutes with. Reducing operations keep their relative order.
+        for i in range(len(ops)):
+            op = ops[i]
+            if callable(op) or _pixels(shapes[i + 1]) >= _pixels(shapes[i]):
+                continue
+
+            j, exact = i, True
+            while j > 0:
+                legal, identical = _commutes(ops[j - 1], op, self.commute)
+                if not legal:
+                    break
+                exact = exact and identical
+                j -= 1
+
+            if j < i:
+                notes.append('moved {} before {}{}'.format(_format(op), _format(ops[j]), '' if exact else ' (approximate)'))
+                ops.insert(j, ops.pop(i))
+                shapes = shapes[:j + 1] + [_output_shape(op, shapes[j])] + [None] * (len(ops) - j - 1)
+                for k in range(j + 1, len(ops)):
+                    shapes[k + 1] = _output_shape(ops[k], shapes[k])
+
+        if self.commute == 'approximate' and self.fuse:
+            ops = self._group(ops, notes)
+
+        return ops, notes
+
+    def _group(self, ops, notes):
+        '''Moves lookup table operations after the warps of a run of
+        affine and table operations, if their merged table maps 0 to 0 -
+        the black border of the warps then stays black.'''
+
+        result, i = [], 0
+        while i < len(ops):
+            j = i
+            while j < len(ops) and not callable(ops[j]) and ops[j][0] in AFFINE_OPS + LUT_OPS:
+                j += 1
+            if j == i:
+                result.append(ops[i])
+                i += 1
+                continue
+
+            run = ops[i:j]
+            warps = [op for op in run if op[0] in AFFINE_OPS]
+            tables = [op for op in run if op[0] in LUT_OPS]
+            grouped = warps + tables
+            if grouped != run and len(warps) > 1 and _fuse(LUTPipeline(), tables).table()[0] == 0:
+                notes.append('moved {} after {} (approximate)'.format(', '.join(_format(op) for op in tables), _format(warps[-1])))
+                run = grouped
+            result += run
+            i = j
+        return result
+
+    def stages(self, shape):
+        '''Returns the stages for images of the given shape - a list of
+        (kind, ops, fused) with kind 'op', 'affine' or 'lut' and the
+        AffinePipeline or LUTPipeline of fused stages - and the notes
+        on moved operations.'''
+
+        key = tuple(shape)
+        if key in self._cache:
+            return self._cache[key]
+
+        ops, notes = self._reorder(shape)
+        stages, i = [], 0
+        while i < len(ops):
+            kind = 'op'
+            if not callable(ops[i]):
+                if ops[i][0] in LUT_OPS:
+                    kind = 'lut'
+                elif ops[i][0] in AFFINE_OPS and self.fuse and self.commute == 'approximate':
+                    kind = 'affine'
+
+            j = i + 1
+            if kind != 'op':
+                group = LUT_OPS if kind == 'lut' else AFFINE_OPS
+                while j < len(ops) and not callable(ops[j]) and ops[j][0] in group:
+                    j += 1
+
+            if j - i > 1:
+                stages.append((kind, ops[i:j], _fuse(LUTPipeline() if kind == 'lut' else AffinePipeline(), ops[i:j])))
+            else:
+                stages.append(('op', ops[i:j], None))
+            i = j
+
+        self._cache[key] = (stages, notes)
+        return stages, notes
+
+    def __call__(self, img, boxes = None):
+        '''Applies the plan. Boxes, an (N, 4) array or None, are carried
+        through the geometric operations as in 'apply_ops'.'''
+
+        for kind, ops, fused in self.stages(img.shape)[0]:
+            if fused is None:
+                img, boxes = apply_ops(img, boxes, ops)
+            elif kind == 'lut':
+                img = fused(img)
+            elif boxes is not None and len(boxes) > 0:
+                img, boxes = _transform_boxes(fused, img, boxes)
+            else:
+                img = fused(img)
+        return img, boxes
+
+    def explain(self, shape, cost_model = None):
+        '''Returns a table of the stages for an image of the given shape
+        with input and output shape, input pixels and estimated time of
+        every stage, and totals against running the chain as written.
+        Times come from 'cost_model', by default a shared CostModel
+        which measures every kind of stage once.'''
+
+        model = _default_model() if cost_model is None else cost_model
+        stages, notes = self.stages(shape)
+
+        lines = ['{:>3}  {:<60} {:>14} {:>14} {:>12} {:>9}'.format('#', 'stage', 'input', 'output', 'pixels', 'est. ms')]
+        total, pixels, shape_in = 0.0, 0, tuple(shape)
+        for n, stage in enumerate(stages, 1):
+            kind, ops, fused = stage
+            shape_out = shape_in
+            for op in ops:
+                shape_out = _output_shape(op, shape_out)
+            seconds = model.cost(stage, shape_in, shape_out)
+            total += seconds or 0.0
+            pixels += _pixels(shape_in)
+
+            name = _format(ops[0]) if fused is None else '{}: {}'.format(type(fused).__name__, ', '.join(_format(op) for op in ops))
+            lines.append('{:>3}  {:<60} {:>14} {:>14} {:>12d} {:>9}'.format(n, name, _format_shape(shape_in), _format_shape(shape_out),
+                                                                           _pixels(shape_in), '-' if seconds is None else '{:.3f}'.format(seconds * 1e3)))
+            shape_in = shape_out
+
+        original, original_pixels, shape_in = 0.0, 0, tuple(shape)
+        for op in self.ops:
+            shape_out = _output_shape(op, shape_in)
+            original += model.cost(('op', [op], None), shape_in, shape_out) or 0.0
+            original_pixels += _pixels(shape_in)
+            shape_in = shape_out
+
+        lines.append('planned {:.3f} ms, {} pixels - as written {:.3f} ms, {} pixels ({:.1f}x)'.format(
+            total * 1e3, pixels, original * 1e3, original_pixels, original / total if total else 1.0))
+        return '\n'.join(lines + notes)
+
+
+# Arguments used to measure operations whose own arguments do not fit
+# the calibration image.
+CALIBRATION = {
+    'crop': lambda h, w: dict(point1 = (w // 4, h // 4), point2 = (3 * w // 4, 3 * h // 4)),
+    'random_resized_crop': lambda h, w: dict(size = (w // 2, h // 2), rng = 0),
+    'randomErase': lambda h, w: dict(size = (w // 8, h // 8), rng = 0),
+    'randomCropAdd': lambda h, w: dict(size = (w // 8, h // 8), rng = 0),
+}
+
+
+class CostModel:
+    '''Per-pixel cost of plan stages, measured on this machine. Every
+    distinct operation (fused stages by kind) is timed once on a
+    calibration image of 'size' (w, h) with the channels of the planned
+    image, taking the median of 'repeat' runs. Cost of a stage is its
+    rate times the pixels it reads and writes - only writes for crop.'''
+
+    def __init__(self, size = (256, 256), repeat = 5):
+        assert (type(size) == tuple and len(size) == 2 and type(size[0]) == int and type(size[1]) == int and size[0] > 0 and size[1] > 0), "Argument 'size' must be of type tuple with two positive int values - (w, h)."
+
+        assert type(repeat) == int and repeat > 0, "Argument 'repeat' must be a positive int."
+
+        self.size = size
+        self.repeat = repeat
+        self.rates = {}
+        self._lock = threading.Lock()
+
+    def _image(self, channels):
+        rng = np.random.default_rng(0)
+        shape = (self.size[1], self.size[0]) + ((channels,) if channels else ())
+        return cv2.GaussianBlur(rng.integers(0, 256, shape, dtype = np.uint8), (5, 5), 0)
+
+    def _time(self, func, img):
+        func(img)
+        times = []
+        for _ in range(self.repeat):
+            start = time.perf_counter()
+            func(img)
+            times.append(time.perf_counter() - start)
+        return float(np.median(times))
+
+    @staticmethod
+    def _work(stage, shape, shape_new):
+        if stage[0] == 'op' and not callable(stage[1][0]) and stage[1][0][0] == 'crop':
+            return _pixels(shape_new)
+        return _pixels(shape) + _pixels(shape_new)
+
+    def rate(self, stage, channels = 3):
+        '''Returns seconds per pixel of a stage, or None for callables.'''
+
+        kind, ops, fused = stage
+        if kind == 'op' and callable(ops[0]):
+            return None
+
+        key = (kind if kind != 'op' else _format(ops[0]), channels)
+        with self._lock:
+            if key in self.rates:
+                return self.rates[key]
+
+        img = self._image(channels)
+        if kind == 'lut':
+            func = LUTPipeline().gamma(0.8).invert()
+        elif kind == 'affine':
+            func = AffinePipeline().rotate(10).translate(5, 5)
+        else:
+            op = ops[0]
+            try:
+                apply_ops(img, None, [op])
+            except (AssertionError, cv2.error):
+                op = (op[0], (), CALIBRATION[op[0]](*img.shape[:2])) if op[0] in CALIBRATION else (op[0], (), {})
+            func = lambda img: apply_ops(img, None, [op])
+            stage = ('op', [op], None)
+
+        seconds = self._time(func, img)
+        result = func(img)
+        result = result[0] if type(result) == tuple else result
+        rate = seconds / self._work(stage, img.shape, result.shape)
+        with self._lock:
+            self.rates[key] = rate
+        return rate
+
+    def cost(self, stage, shape, shape_new):
+        '''Returns the estimated seconds of a stage reading an image of
+        'shape' and writing one of 'shape_new', or None for callables.'''
+
+        rate = self.rate(stage, shape[2] if len(shape) > 2 else 0)
+        return None if rate is None else rate * self._work(stage, shape, shape_new)
+
+
+_model = None
+
+
+def _default_model():
+    global _model
+    if _model is None:
+        _model = CostModel()
+    return _model
+
+
+def _signed(m, rng):
+    return m if rng.random() < 0.5 else -m
+
+
+def _translate(m, h, w, rng):
+    if rng.random() < 0.5:
+        return ('translate', (), {'tx': int(round(0.3 * w * _signed(m, rng))), 'ty': 0})
+    return ('translate', (), {'tx': 0, 'ty': int(round(0.3 * h * _signed(m, rng)))})
+
+
+# RandAugment-style operations. Every entry returns the parsed operation
+# for magnitude 'm' between 0 and 1 and an image of height 'h', width 'w'.
+SPACE = {
+    'rotate': lambda m, h, w, rng: ('rotate', (), {'angle': round(30 * _signed(m, rng), 2)}),
+    'shear': lambda m, h, w, rng: ('shear', (), {'shear_val': round(0.3 * _signed(m, rng), 3), 'axis': int(rng.integers(2))}),
+    'translate': _translate,
+    'scale': lambda m, h, w, rng: ('scale', (), {'fx': 1 + 0.5 * m, 'fy': 1 + 0.5 * m, 'keep_resolution': True}),
+    'brightness_contrast': lambda m, h, w, rng: ('brightness_contrast', (), {'alpha': round(1 + 0.5 * _signed(m, rng), 3), 'beta': int(round(64 * _signed(m, rng)))}),
+    'gamma': lambda m, h, w, rng: ('gamma', (), {'gamma_val': round(2 ** _signed(m, rng), 3)}),
+    'invert': lambda m, h, w, rng: ('invert', (), {}),
+    'posterize': lambda m, h, w, rng: ('posterize', (), {'bits': 8 - int(round(4 * m))}),
+    'color_jitter': lambda m, h, w, rng: ('color_jitter', (), {'hue': int(round(18 * _signed(m, rng))), 'saturation': round(1 + 0.9 * _signed(m, rng), 3)}),
+    'blur': lambda m, h, w, rng: ('blur', ('gaussian',), {'ksize': (2 * int(round(1 + 3 * m)) + 1,) * 2}),
+    'sharpen': lambda m, h, w, rng: ('sharpen', (), {}),
+    'addNoise': lambda m, h, w, rng: ('addNoise', ('gaussian',), {'var': round(0.001 + 0.02 * m, 4)}),
+    'randomErase': lambda m, h, w, rng: ('randomErase', (), {'size': (max(1, int(0.3 * m * w)), max(1, int(0.3 * m * h)))}),
+}
+
+
+def _seeded(op, rng):
+    '''Returns the operation with an int seed drawn from 'rng' as its
+    'rng' argument, if it takes one which is not set.'''
+
+    if callable(op) or 'rng' not in inspect.signature(OPS[op[0]]).parameters or _arguments(op)['rng'] is not None:
+        return op
+    return (op[0], op[1], dict(op[2], rng = int(rng.integers(2**63))))
+
+
+class Policy:
+    '''RandAugment-style policy. Every call draws 'n' operations
+    uniformly, with replacement, from 'ops' (names of SPACE, default
+    all of them) at the shared 'magnitude' between 0 and 10; the sign
+    of signed parameters is drawn too. Fixed operations of 'pre' and
+    'post' run before and after the sampled ones. The chain is run
+    through a Plan with the given 'commute' and 'fuse' arguments.
+    Random operations, also those of 'pre' and 'post', are seeded from
+    'rng', so a seeded policy gives reproducible results.
+
+    A policy takes and returns (img, boxes), so it can be passed to
+    'apply_ops' or AugmentStream as an operation. Sampling is locked,
+    so one policy can be shared by threads.'''
+
+    def __init__(self, n = 2, magnitude = 9, ops = None, pre = (), post = (), commute = 'exact', fuse = True, rng = None):
+        assert type(n) == int and n >= 0, "Argument 'n' must be a non-negative int."
+
+        assert (type(magnitude) == int or type(magnitude) == float) and 0 <= magnitude <= 10, "Argument 'magnitude' must be of type int or float and must lie between 0 and 10."
+
+        ops = list(SPACE) if ops is None else list(ops)
+        assert len(ops) > 0 and all(op in SPACE for op in ops), "Argument 'ops' can only contain - {}.".format(', '.join(SPACE))
+
+        assert commute in COMMUTE, "Argument 'commute' can only be one of - {}.".format(', '.join(COMMUTE))
+
+        self.n = n
+        self.magnitude = magnitude
+        self.choices = ops
+        self.pre = [parse_op(op) if type(op) == str else op for op in pre]
+        self.post = [parse_op(op) if type(op) == str else op for op in post]
+        self.commute = commute
+        self.fuse = fuse
+        self.rng = _get_rng(rng)
+        self._lock = threading.Lock()
+
+    def sample(self, shape):
+        '''Returns a sampled chain of parsed operations for an image of the
+        given shape. Pixel sizes are drawn for the image after 'pre'.
+        Operations drawing random numbers get a seed from the policy's
+        generator, unless their 'rng' is set already.'''
+
+        for op in self.pre:
+            shape = _output_shape(op, shape)
+        h, w = shape[:2]
+        m = self.magnitude / 10
+        with self._lock:
+            names = [self.choices[i] for i in self.rng.integers(len(self.choices), size = self.n)]
+            ops = [SPACE[name](m, h, w, self.rng) for name in names]
+            ops = [_seeded(op, self.rng) for op in self.pre + ops + self.post]
+        return ops
+
+    def plan(self, shape):
+        '''Returns the Plan of a sampled chain.'''
+
+        return Plan(self.sample(shape), self.commute, self.fuse)
+
+    def __call__(self, img, boxes = None):
+        return self.plan(img.shape)(img, boxes)
+
+    def explain(self, shape, cost_model = None):
+        '''Returns 'Plan.explain' of a sampled chain.'''
+
+        return self.plan(shape).explain(shape, cost_model)
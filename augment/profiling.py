@@ -0,0 +1,138 @@
+'''Per-operation profiling of the augmentation functions.
+
+Every public function of the geometric, photometric and kernel_based
+modules reports its calls to the registered hooks. When no hook is
+registered, the only cost is one check of a module level list.
+
+Example:
+    with profile() as prof:
+        img_new = rotate(img, 15)
+        img_new = blur(img_new, 'gaussian', ksize = (9, 9))
+    print(prof.summary())
+    prof.save_trace('trace.json')   # open in chrome://tracing or Perfetto
+'''
+
+import functools
+import json
+import os
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+
+
+_hooks = []
+
+
+def add_hook(hook):
+    '''Registers a callable which is called with an event dict after
+    every call of an augmentation function. Event keys - 'name',
+    'start' and 'duration' (seconds), 'thread', 'shape' (of the input
+    image) and 'bytes' (size of newly allocated output arrays).'''
+
+    assert callable(hook), "Argument 'hook' must be callable."
+
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    '''Unregisters a hook added with 'add_hook'.'''
+
+    _hooks.remove(hook)
+
+
+def _allocated(result, args, kwargs):
+    '''Returns bytes of the arrays in 'result' which were allocated by
+    the call, i.e. which are not the passed image or 'out' buffer.'''
+
+    arrays = result if type(result) == tuple else (result,)
+    known = [kwargs.get('out')] + ([args[0]] if args else [kwargs.get('img')])
+    return sum(a.nbytes for a in arrays if type(a) == np.ndarray and not any(a is k for k in known))
+
+
+def instrument(func):
+    '''Decorator reporting calls of 'func' to the registered hooks.'''
+
+    name = func.__module__.rsplit('.', 1)[-1] + '.' + func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _hooks:
+            return func(*args, **kwargs)
+
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        duration = time.perf_counter() - start
+
+        img = args[0] if args else kwargs.get('img')
+        event = {'name': name, 'start': start, 'duration': duration, 'thread': threading.get_ident(),
+                 'shape': getattr(img, 'shape', None), 'bytes': _allocated(result, args, kwargs)}
+        for hook in list(_hooks):
+            hook(event)
+        return result
+
+    return wrapper
+
+
+class profile:
+    '''Context manager recording every call of the augmentation functions
+    made while it is active, from any thread.'''
+
+    def __init__(self):
+        self.events = []
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        with self._lock:
+            self.events.append(event)
+
+    def __enter__(self):
+        add_hook(self)
+        return self
+
+    def __exit__(self, *exc):
+        remove_hook(self)
+        return False
+
+    def stats(self):
+        '''Returns per-function statistics - calls, total and mean time in
+        seconds, allocated bytes and counts of the input shapes.'''
+
+        stats = {}
+        for event in self.events:
+            s = stats.setdefault(event['name'], {'calls': 0, 'seconds': 0.0, 'bytes': 0, 'shapes': Counter()})
+            s['calls'] += 1
+            s['seconds'] += event['duration']
+            s['bytes'] += event['bytes']
+            s['shapes'][event['shape']] += 1
+        for s in stats.values():
+            s['mean_seconds'] = s['seconds'] / s['calls']
+        return stats
+
+    def summary(self):
+        '''Returns a text table of the statistics, slowest functions first.'''
+
+        stats = sorted(self.stats().items(), key = lambda item: -item[1]['seconds'])
+        lines = ['{:<34} {:>7} {:>11} {:>10} {:>10}  {}'.format('function', 'calls', 'total ms', 'mean ms', 'MB alloc', 'most common shape')]
+        for name, s in stats:
+            lines.append('{:<34} {:>7d} {:>11.2f} {:>10.3f} {:>10.1f}  {}'.format(
+                name, s['calls'], s['seconds'] * 1e3, s['mean_seconds'] * 1e3, s['bytes'] / 2**20, s['shapes'].most_common(1)[0][0]))
+        return '\n'.join(lines)
+
+    def trace(self):
+        '''Returns the events in Chrome trace-event format.'''
+
+        origin = min((event['start'] for event in self.events), default = 0.0)
+        return {'traceEvents': [{'name': event['name'], 'cat': 'augment', 'ph': 'X',
+                                 'ts': (event['start'] - origin) * 1e6, 'dur': event['duration'] * 1e6,
+                                 'pid': os.getpid(), 'tid': event['thread'],
+                                 'args': {'shape': event['shape'], 'bytes': event['bytes']}}
+                                for event in self.events],
+                'displayTimeUnit': 'ms'}
+
+    def save_trace(self, path):
+        '''Writes the Chrome trace-event json to 'path'.'''
+
+        with open(path, 'w') as f:
+            json.dump(self.trace(), f)
@@ -0,0 +1,286 @@
+'''Sharded binary output for augmented datasets.
+
+Results are appended to a few large shard files instead of millions of
+small image and annotation files. Every shard is a pair of files -
+'<prefix>-00000.bin' holding the encoded images followed by their boxes,
+and '<prefix>-00000.idx' holding one fixed size index record per image.
+The index is only appended after its data was written, so a shard cut
+short by a crash is still readable up to its last complete record.
+
+Example:
+    with ShardWriter('dataset/', codec = 'jpeg', quality = 90, workers = 4) as writer:
+        for img, boxes in AugmentStream(source, ops):
+            writer.write(img, boxes)
+    print(writer.stats())
+
+    reader = ShardReader('dataset/')
+    img, boxes = reader[12345]
+'''
+
+import glob
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+
+CODECS = ('raw', 'jpeg', 'png')
+FSYNC = ('never', 'shard', 'always')
+
+INDEX_DTYPE = np.dtype([('offset', '<u8'), ('length', '<u8'), ('height', '<u4'), ('width', '<u4'),
+                        ('channels', '<u1'), ('codec', '<u1'), ('box_count', '<u4')])
+
+
+def _encode(img, boxes, codec, params):
+    '''Returns the record bytes of one image - encoded image followed by
+    the boxes as float64 - and the index fields.'''
+
+    if codec == 'raw':
+        data = np.ascontiguousarray(img).tobytes()
+    else:
+        ok, buffer = cv2.imencode('.jpg' if codec == 'jpeg' else '.png', img, params)
+        if not ok:
+            raise ValueError("Could not encode image with codec '{}'.".format(codec))
+        data = buffer.tobytes()
+
+    if boxes is None:
+        boxes = np.zeros((0, 4))
+    boxes = np.ascontiguousarray(boxes, dtype = '<f8').reshape(-1, 4)
+
+    channels = img.shape[2] if img.ndim == 3 else 1
+    return data, boxes.tobytes(), (len(data), img.shape[0], img.shape[1], channels, CODECS.index(codec), len(boxes))
+
+
+class ShardWriter:
+    '''Writes (img, boxes) records into append-only shards in 'directory'.
+
+    Images are encoded on a pool of 'workers' threads while records are
+    appended in the order they were passed. At most 'max_pending' images
+    wait for encoding, after which 'write' blocks. A new shard is started
+    when the current one would grow past 'shard_size' bytes.
+
+    'codec' is 'jpeg', 'png' or 'raw' (uncompressed uint8, decoded without
+    a copy by the reader). 'quality' is the JPEG quality (0 - 100, default
+    95) or PNG compression level (0 - 9, default 3). 'fsync' is 'never',
+    'shard' (when a shard is closed) or 'always' (after every record).'''
+
+    def __init__(self, directory, codec = 'jpeg', quality = None, shard_size = 2**30, workers = 4,
+                 max_pending = 64, fsync = 'shard', prefix = 'shard'):
+        assert codec in CODECS, "Argument 'codec' can only be one of - {}.".format(', '.join(CODECS))
+
+        if quality is None:
+            quality = {'jpeg': 95, 'png': 3, 'raw': 0}[codec]
+        assert type(quality) == int and 0 <= quality <= (100 if codec == 'jpeg' else 9), "Argument 'quality' must be an int between 0 and 100 for jpeg, 0 and 9 for png."
+
+        assert type(shard_size) == int and shard_size > 0, "Argument 'shard_size' must be a positive int."
+
+        assert type(workers) == int and workers > 0, "Argument 'workers' must be a positive int."
+
+        assert type(max_pending) == int and max_pending >= workers, "Argument 'max_pending' must be an int not smaller than 'workers'."
+
+        assert fsync in FSYNC, "Argument 'fsync' can only be one of - {}.".format(', '.join(FSYNC))
+
+        os.makedirs(directory, exist_ok = True)
+        self.directory = directory
+        self.codec = codec
+        self.quality = quality
+        self.shard_size = shard_size
+        self.max_pending = max_pending
+        self.fsync = fsync
+        self.prefix = prefix
+
+        if codec == 'jpeg':
+            self._params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+        elif codec == 'png':
+            self._params = [cv2.IMWRITE_PNG_COMPRESSION, quality]
+        else:
+            self._params = []
+
+        # Continue after the shards already in the directory.
+        self._shard = len(glob.glob(os.path.join(directory, prefix + '-*.idx')))
+        self._data = None
+        self._index = None
+        self._offset = 0
+        self._pool = ThreadPoolExecutor(workers)
+        self._pending = deque()
+        self._lock = threading.Lock()
+
+        self.records = 0
+        self.shards = 0
+        self.input_bytes = 0
+        self.written_bytes = 0
+        self.encode_seconds = 0.0
+        self.write_seconds = 0.0
+        self.fsync_seconds = 0.0
+        self._start = time.perf_counter()
+
+    def _timed_encode(self, img, boxes):
+        start = time.perf_counter()
+        result = _encode(img, boxes, self.codec, self._params)
+        with self._lock:
+            self.encode_seconds += time.perf_counter() - start
+        return result
+
+    def write(self, img, boxes = None):
+        '''Queues one image with its boxes (None, a box [x1, y1, x2, y2] or
+        an array of shape (N, 4)) and returns its record number. The image
+        is encoded later, so it must not be modified until 'flush' - pass
+        a copy when reusing output buffers.'''
+
+        assert type(img) == np.ndarray and img.dtype == np.uint8 and img.ndim in (2, 3), "Argument 'img' must be a numpy.ndarray of type uint8 with 2 or 3 dimensions."
+
+        if self._pool is None:
+            raise ValueError('Writer is closed.')
+
+        number = self.records + len(self._pending)
+        self.input_bytes += img.nbytes
+        self._pending.append(self._pool.submit(self._timed_encode, img, boxes))
+
+        while self._pending and (self._pending[0].done() or len(self._pending) > self.max_pending):
+            self._append(*self._pending.popleft().result())
+        return number
+
+    def write_all(self, results):
+        '''Writes every (img, boxes) item of an iterable, e.g. an AugmentStream.'''
+
+        for img, boxes in results:
+            self.write(img, boxes)
+
+    def _sync(self, f):
+        start = time.perf_counter()
+        f.flush()
+        os.fsync(f.fileno())
+        self.fsync_seconds += time.perf_counter() - start
+
+    def _close_shard(self):
+        if self._data is None:
+            return
+        if self.fsync != 'never':
+            self._sync(self._data)
+            self._sync(self._index)
+        self._data.close()
+        self._index.close()
+        self._data = self._index = None
+        self._shard += 1
+
+    def _append(self, data, boxes, fields):
+        start = time.perf_counter()
+        size = len(data) + len(boxes)
+        if self._data is not None and self._offset + size > self.shard_size and self._offset > 0:
+            self._close_shard()
+
+        if self._data is None:
+            path = os.path.join(self.directory, '{}-{:05d}'.format(self.prefix, self._shard))
+            self._data = open(path + '.bin', 'wb')
+            self._index = open(path + '.idx', 'wb')
+            self._offset = 0
+            self.shards += 1
+
+        self._data.write(data)
+        self._data.write(boxes)
+        self._data.flush()
+        self._index.write(np.array([(self._offset,) + fields], dtype = INDEX_DTYPE).tobytes())
+        self._index.flush()
+        self._offset += size
+
+        if self.fsync == 'always':
+            self._sync(self._data)
+            self._sync(self._index)
+
+        self.records += 1
+        self.written_bytes += size
+        self.write_seconds += time.perf_counter() - start
+
+    def flush(self):
+        '''Waits for all queued images and appends them.'''
+
+        while self._pending:
+            self._append(*self._pending.popleft().result())
+
+    def close(self):
+        '''Flushes, closes the current shard and stops the encoding threads.'''
+
+        if self._pool is None:
+            return
+        try:
+            self.flush()
+        finally:
+            self._close_shard()
+            self._pool.shutdown(wait = True)
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def stats(self):
+        '''Returns counts of records and shards, bytes in and out, time
+        spent encoding (summed over threads), writing and in fsync, and
+        throughput in records and input megabytes per second.'''
+
+        elapsed = time.perf_counter() - self._start
+        return {'records': self.records, 'pending': len(self._pending), 'shards': self.shards,
+                'input_bytes': self.input_bytes, 'written_bytes': self.written_bytes,
+                'encode_seconds': self.encode_seconds, 'write_seconds': self.write_seconds,
+                'fsync_seconds': self.fsync_seconds, 'elapsed_seconds': elapsed,
+                'records_per_second': self.records / elapsed if elapsed else 0.0,
+                'mb_per_second': self.input_bytes / 2**20 / elapsed if elapsed else 0.0}
+
+
+class ShardReader:
+    '''Random access to the records written by ShardWriter. Data and index
+    files are memory-mapped, so opening is cheap and only the records that
+    are read are paged in. Raw records are returned as read-only views of
+    the mapping, without a copy.'''
+
+    def __init__(self, directory, prefix = 'shard'):
+        self._data = []
+        self._index = []
+        for path in sorted(glob.glob(os.path.join(directory, prefix + '-*.idx'))):
+            # A partially written last index record is ignored.
+            count = os.path.getsize(path) // INDEX_DTYPE.itemsize
+            if count == 0:
+                continue
+            self._index.append(np.memmap(path, dtype = INDEX_DTYPE, mode = 'r', shape = (count,)))
+            self._data.append(np.memmap(path[:-4] + '.bin', dtype = np.uint8, mode = 'r'))
+
+        self._starts = np.cumsum([0] + [len(index) for index in self._index])
+
+    def __len__(self):
+        return int(self._starts[-1])
+
+    def __getitem__(self, i):
+        '''Returns (img, boxes) of record 'i', boxes as an array of shape (N, 4).'''
+
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('Record index out of range.')
+
+        shard = int(np.searchsorted(self._starts, i, side = 'right')) - 1
+        entry = self._index[shard][i - self._starts[shard]]
+        data = self._data[shard]
+        start, length = int(entry['offset']), int(entry['length'])
+
+        payload = data[start : start + length]
+        codec = CODECS[entry['codec']]
+        if codec == 'raw':
+            shape = (int(entry['height']), int(entry['width'])) + ((int(entry['channels']),) if entry['channels'] > 1 else ())
+            img = np.asarray(payload).reshape(shape)
+        else:
+            img = cv2.imdecode(np.asarray(payload), cv2.IMREAD_UNCHANGED)
+
+        count = int(entry['box_count'])
+        boxes = np.frombuffer(data, dtype = '<f8', count = count * 4, offset = start + length).reshape(count, 4)
+        return img, boxes
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
@@ -0,0 +1,143 @@
+'''Streaming augmentation on a bounded thread pool.
+
+OpenCV releases the GIL inside its image functions, so a few threads are
+enough to keep a training loop fed without paying for worker processes.
+
+Example:
+    stream = AugmentStream(dataset, ["rotate(angle = 15)", "blur('gaussian', ksize = (5, 5))"], workers = 4, prefetch = 16)
+    for img, boxes in stream:
+        ...
+'''
+
+import os
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import cv2
+import numpy as np
+
+from .chain import apply_ops, parse_op
+
+
+class AugmentStream:
+    '''Iterator which applies a chain of operations to every (img, boxes)
+    item of 'source' on a pool of 'workers' threads. At most 'prefetch'
+    items are pulled from the source ahead of the consumer, which bounds
+    memory and gives backpressure when the consumer is slow.
+
+    Operations are given as strings, e.g. "rotate(angle = 15)", as parsed
+    (name, args, kwargs) tuples, or as callables taking and returning
+    (img, boxes). Boxes can be None or an (N, 4) array.
+
+    Results are yielded in source order if 'ordered' is True, otherwise
+    as soon as they are ready. While iterating, OpenCV's internal thread
+    count is set to 'cv2_threads' (default - cpu count divided by the
+    number of workers) so that the pool does not oversubscribe the cores.
+    This setting is process wide and is restored when iteration ends.'''
+
+    def __init__(self, source, ops, workers = 4, prefetch = 8, ordered = True, cv2_threads = None):
+        assert type(workers) == int and workers > 0, "Argument 'workers' must be a positive int."
+
+        assert type(prefetch) == int and prefetch >= workers, "Argument 'prefetch' must be an int not smaller than 'workers'."
+
+        assert type(ordered) == bool, "Argument 'ordered' can only be True or False."
+
+        assert cv2_threads is None or (type(cv2_threads) == int and cv2_threads >= 0), "Argument 'cv2_threads' must be None or a non-negative int."
+
+        self.source = source
+        self.ops = [parse_op(op) if type(op) == str else op for op in ops]
+        self.workers = workers
+        self.prefetch = prefetch
+        self.ordered = ordered
+        self.cv2_threads = max(1, (os.cpu_count() or 1) // workers) if cv2_threads is None else cv2_threads
+        self._pending = ()
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self.submitted = 0
+        self.yielded = 0
+        self.max_in_flight = 0
+        self.source_seconds = 0.0
+        self.wait_seconds = 0.0
+
+    def _work(self, img, boxes):
+        if boxes is not None:
+            boxes = np.asarray(boxes, dtype = np.float64).reshape(-1, 4)
+        return apply_ops(img, boxes, self.ops)
+
+    @property
+    def in_flight(self):
+        '''Number of items pulled from the source but not yet yielded.'''
+
+        return len(self._pending)
+
+    @property
+    def ready(self):
+        '''Number of finished items waiting for the consumer.'''
+
+        return sum(1 for future in self._pending if future.done())
+
+    def stats(self):
+        '''Returns queue depths and timings. A high 'wait_seconds' means the
+        consumer is starved (more workers may help), a 'ready' count close
+        to 'prefetch' means the consumer is the bottleneck.'''
+
+        return {'submitted': self.submitted, 'yielded': self.yielded,
+                'in_flight': self.in_flight, 'ready': self.ready,
+                'max_in_flight': self.max_in_flight, 'prefetch': self.prefetch,
+                'source_seconds': self.source_seconds, 'wait_seconds': self.wait_seconds}
+
+    def __iter__(self):
+        self._reset_stats()
+        source = iter(self.source)
+        pending = deque() if self.ordered else set()
+        self._pending = pending
+        exhausted = False
+
+        threads = cv2.getNumThreads()
+        cv2.setNumThreads(self.cv2_threads)
+        pool = ThreadPoolExecutor(self.workers)
+
+        try:
+            while True:
+                while not exhausted and len(pending) < self.prefetch:
+                    start = time.perf_counter()
+                    try:
+                        img, boxes = next(source)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    finally:
+                        self.source_seconds += time.perf_counter() - start
+
+                    future = pool.submit(self._work, img, boxes)
+                    if self.ordered:
+                        pending.append(future)
+                    else:
+                        pending.add(future)
+                    self.submitted += 1
+                    self.max_in_flight = max(self.max_in_flight, len(pending))
+
+                if not pending:
+                    return
+
+                start = time.perf_counter()
+                if self.ordered:
+                    future = pending[0]
+                    result = future.result()
+                    pending.popleft()
+                else:
+                    future = next(iter(wait(pending, return_when = FIRST_COMPLETED).done))
+                    result = future.result()
+                    pending.discard(future)
+                self.wait_seconds += time.perf_counter() - start
+
+                self.yielded += 1
+                yield result
+
+        finally:
+            for future in pending:
+                future.cancel()
+            pool.shutdown(wait = True)
+            cv2.setNumThreads(threads)
@@ -0,0 +1,163 @@
+'''Tiled processing of images which do not fit in memory.
+
+The source can be an np.memmap or any array-like supporting 2D slicing
+and the result is written tile by tile into 'out', which is usually an
+np.memmap too. Peak memory depends on the tile size and the number of
+workers, not on the size of the image.
+
+Example:
+    src = np.load('scene.npy', mmap_mode = 'r')
+    shape = output_shape(src.shape, 'rotate', angle = 10, keep_resolution = False)
+    dst = np.lib.format.open_memmap('rotated.npy', mode = 'w+', dtype = np.uint8, shape = shape)
+    apply_tiled(src, 'rotate', out = dst, tile_size = (2048, 2048), workers = 4, angle = 10, keep_resolution = False)
+'''
+
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from . import kernel_based, photometric
+from ._common import _get_rng
+from .geometric import AffinePipeline
+from .photometric import LUTPipeline
+
+
+POINTWISE = ('brightness_contrast', 'gamma', 'invert', 'posterize', 'color_jitter', 'addNoise')
+KERNEL = ('blur', 'sharpen')
+AFFINE = ('rotate', 'scale', 'shear', 'translate')
+
+
+def _halo(op, kwargs):
+    '''Returns the number of neighbouring pixels a kernel operation reads.'''
+
+    if op == 'sharpen':
+        return 1
+
+    if kwargs.get('blur_type', 'avg') == 'median':
+        return kwargs.get('median_ksize', 5) // 2
+
+    return max(kwargs.get('ksize', (5, 5))) // 2
+
+
+def _pipeline(op, kwargs):
+    '''Returns the AffinePipeline of a geometric operation.'''
+
+    if isinstance(op, AffinePipeline):
+        return op
+    return getattr(AffinePipeline(), op)(**kwargs)
+
+
+def output_shape(shape, op, **kwargs):
+    '''Returns the shape of the result of 'apply_tiled' for an image
+    of the given shape, e.g. to create the output memmap.'''
+
+    if isinstance(op, AffinePipeline) or op in AFFINE:
+        dsize = _pipeline(op, kwargs).matrix(shape)[1]
+        return (dsize[1], dsize[0]) + tuple(shape[2:])
+    return tuple(shape)
+
+
+def _tiles(shape, tile_size):
+    h, w = shape[:2]
+    for y0, x0 in itertools.product(range(0, h, tile_size[1]), range(0, w, tile_size[0])):
+        yield y0, x0, min(y0 + tile_size[1], h), min(x0 + tile_size[0], w)
+
+
+def _affine_tile(img, M, border, out, tile):
+    '''Warps one output tile. Only the source window the tile maps back
+    to, plus a margin for interpolation, is read.'''
+
+    y0, x0, y1, x1 = tile
+    h, w = img.shape[:2]
+    Mi = cv2.invertAffineTransform(M)
+    corners = np.float64([[x0, y0, 1], [x1 - 1, y0, 1], [x0, y1 - 1, 1], [x1 - 1, y1 - 1, 1]]) @ Mi.T
+    sx0, sy0 = np.floor(corners.min(axis = 0)).astype(int) - 2
+    sx1, sy1 = np.ceil(corners.max(axis = 0)).astype(int) + 3
+    sx0, sy0, sx1, sy1 = max(sx0, 0), max(sy0, 0), min(sx1, w), min(sy1, h)
+
+    if sx0 >= sx1 or sy0 >= sy1:
+        out[y0:y1, x0:x1] = 0
+        return
+
+    window = np.ascontiguousarray(img[sy0:sy1, sx0:sx1])
+    M_tile = M.copy()
+    M_tile[:, 2] += M[:, :2] @ [sx0, sy0] - [x0, y0]
+    out[y0:y1, x0:x1] = cv2.warpAffine(window, M_tile, (x1 - x0, y1 - y0), borderMode = border)
+
+
+def _kernel_tile(img, func, halo, kwargs, out, tile):
+    '''Filters one tile. The tile is read with 'halo' extra pixels on
+    every side, so the result matches filtering the whole image.'''
+
+    y0, x0, y1, x1 = tile
+    h, w = img.shape[:2]
+    sy0, sx0, sy1, sx1 = max(y0 - halo, 0), max(x0 - halo, 0), min(y1 + halo, h), min(x1 + halo, w)
+    result = func(np.ascontiguousarray(img[sy0:sy1, sx0:sx1]), **kwargs)
+    out[y0:y1, x0:x1] = result[y0 - sy0 : y1 - sy0, x0 - sx0 : x1 - sx0]
+
+
+def _pointwise_tile(img, func, kwargs, seed, index, out, tile):
+    y0, x0, y1, x1 = tile
+    if seed is not None:
+        # Every tile gets its own generator, so noise does not repeat
+        # across tiles and does not depend on the processing order.
+        kwargs = dict(kwargs, rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key = (index,))))
+    out[y0:y1, x0:x1] = func(np.ascontiguousarray(img[y0:y1, x0:x1]), **kwargs)
+
+
+def apply_tiled(img, op, out = None, tile_size = (1024, 1024), workers = 1, **kwargs):
+    '''Applies an operation tile by tile and returns 'out'.
+
+    'op' is the name of one of the supported functions - blur, sharpen,
+    brightness_contrast, gamma, invert, posterize, color_jitter, addNoise, rotate,
+    scale, shear, translate - or an AffinePipeline or LUTPipeline. Other
+    keyword arguments are passed to the operation. Geometric operations
+    are run through AffinePipeline. Tiles are processed by 'workers'
+    threads; tiles write disjoint regions of 'out'.'''
+
+    assert (type(tile_size) == tuple and len(tile_size) == 2 and type(tile_size[0]) == int and type(tile_size[1]) == int and tile_size[0] > 0 and tile_size[1] > 0), "Argument 'tile_size' must be of type tuple with two positive int values - (w, h)."
+
+    assert type(workers) == int and workers > 0, "Argument 'workers' must be a positive int."
+
+    assert (isinstance(op, (AffinePipeline, LUTPipeline)) or op in POINTWISE + KERNEL + AFFINE), "Argument 'op' must be an AffinePipeline, a LUTPipeline or one of - {}.".format(', '.join(POINTWISE + KERNEL + AFFINE))
+
+    shape = output_shape(img.shape, op, **kwargs)
+    if out is None:
+        out = np.empty(shape, dtype = img.dtype)
+
+    assert tuple(out.shape) == shape, "Argument 'out' must have shape {}.".format(shape)
+
+    tiles = list(_tiles(shape, tile_size))
+
+    if isinstance(op, AffinePipeline) or op in AFFINE:
+        pipeline = _pipeline(op, kwargs)
+        M, border = pipeline.matrix(img.shape, pixels = True)[0][:2], pipeline.border()
+        work = lambda tile: _affine_tile(img, M, border, out, tile)
+
+    elif op in KERNEL:
+        func, halo = getattr(kernel_based, op), _halo(op, kwargs)
+        work = lambda tile: _kernel_tile(img, func, halo, kwargs, out, tile)
+
+    else:
+        func = op if isinstance(op, LUTPipeline) else getattr(photometric, op)
+        seed = None
+        if op == 'addNoise':
+            rng = kwargs.pop('rng', None)
+            seed = rng if type(rng) == int else int(_get_rng(rng).integers(2**63))
+        indices = {tile: i for i, tile in enumerate(tiles)}
+        work = lambda tile: _pointwise_tile(img, func, kwargs, seed, indices[tile], out, tile)
+
+    if workers == 1:
+        for tile in tiles:
+            work(tile)
+    else:
+        with ThreadPoolExecutor(workers) as pool:
+            for _ in pool.map(work, tiles):
+                pass
+
+    if isinstance(out, np.memmap):
+        out.flush()
+
+    return out
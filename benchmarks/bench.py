@@ -0,0 +1,325 @@
+'''Benchmarks for every augmentation function.
+
+Times each public function of augment.geometric, augment.photometric and
+augment.kernel_based on 256x256, 1080p and 4K inputs with 1 and 3 uint8
+channels, with and without bounding boxes. Inputs are made from the
+bundled images, so the functions see real content.
+
+Usage:
+    python benchmarks/bench.py                                  # print results
+    python benchmarks/bench.py --batch                          # batched API on small crops
+    python benchmarks/bench.py --save baseline.json             # save a baseline
+    python benchmarks/bench.py --compare baseline.json          # fail on regressions
+    python benchmarks/bench.py --sizes 256 --filter rotate,blur
+
+Every result reports the median time per call, throughput in megapixels
+per second, peak traced memory and the number of allocations of a single
+call. '--compare' exits with status 1 if any case is slower than the
+baseline by more than '--threshold' (default 0.2, i.e. 20%).
+
+'--batch' times the functions of augment.batch on batches of 64x64,
+128x128 and 224x224 crops against calling the single-image function on
+every crop, timed alternately and keeping the fastest of 7 rounds. The
+batched functions write into a reused output batch. Each case has a
+minimum speedup over the per-image loop and the run exits with status 1
+if any case is below it:
+
+- vectorized cases (brightness_contrast, addNoise, randomErase,
+  randomCropAdd, crop, shared lookup tables and colorSpace) have their
+  own target of at least 1x, see BATCH_CASES. '--batch-target' sets one
+  target for all of them. Shared tables and colorSpace only save
+  per-call overhead, so they are held to their target on 64x64 crops.
+- warps, resizes, filters and per-image gamma tables run one OpenCV
+  call per image either way. They are expected at parity and fail below
+  '--parity-band' (default 0.95).'''
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from augment import batch, geometric, kernel_based, photometric
+
+
+SIZES = {'256': (256, 256), '1080p': (1080, 1920), '4k': (2160, 3840)}
+IMAGES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'images')
+
+FILTER_BANK = (kernel_based.FilterBank().blur('gaussian', ksize = (5, 5)).blur('gaussian', ksize = (15, 15))
+               .blur('gaussian', ksize = (31, 31)).blur('avg', ksize = (9, 9)).sharpen())
+
+# (name, function, arguments, passes box, channels it supports)
+CASES = [
+    ('crop', geometric.crop, lambda h, w: dict(point1 = (w // 8, h // 8), point2 = (w - w // 8, h - h // 8)), True, (1, 3)),
+    ('rotate', geometric.rotate, lambda h, w: dict(angle = 15), True, (1, 3)),
+    ('rotate_expand', geometric.rotate, lambda h, w: dict(angle = 15, keep_resolution = False), True, (1, 3)),
+    ('scale', geometric.scale, lambda h, w: dict(fx = 0.5, fy = 0.5), True, (1, 3)),
+    ('scale_keep', geometric.scale, lambda h, w: dict(fx = 1.5, fy = 1.5, keep_resolution = True), True, (1, 3)),
+    ('shear', geometric.shear, lambda h, w: dict(shear_val = 0.2), True, (1, 3)),
+    ('translate', geometric.translate, lambda h, w: dict(tx = 50, ty = 60), True, (1, 3)),
+    ('random_resized_crop', geometric.random_resized_crop, lambda h, w: dict(size = (224, 224), rng = 0), True, (1, 3)),
+    ('brightness_contrast', photometric.brightness_contrast, lambda h, w: dict(alpha = 1.3, beta = 20), False, (1, 3)),
+    ('gamma', photometric.gamma, lambda h, w: dict(gamma_val = 0.8), False, (1, 3)),
+    ('invert', photometric.invert, lambda h, w: dict(), False, (1, 3)),
+    ('posterize', photometric.posterize, lambda h, w: dict(bits = 4), False, (1, 3)),
+    ('colorSpace', photometric.colorSpace, lambda h, w: dict(colorspace = 'hsv'), False, (3,)),
+    ('color_jitter', photometric.color_jitter, lambda h, w: dict(hue = 10, saturation = 1.3, value = 0.9), False, (3,)),
+    ('addNoise_gaussian', photometric.addNoise, lambda h, w: dict(noise_type = 'gaussian', rng = 0), False, (1, 3)),
+    ('addNoise_salt_pepper', photometric.addNoise, lambda h, w: dict(noise_type = 'salt_pepper', rng = 0), False, (1, 3)),
+    ('addNoise_poisson', photometric.addNoise, lambda h, w: dict(noise_type = 'poisson', rng = 0), False, (1, 3)),
+    ('blur_avg', kernel_based.blur, lambda h, w: dict(blur_type = 'avg', ksize = (9, 9)), False, (1, 3)),
+    ('blur_gaussian', kernel_based.blur, lambda h, w: dict(blur_type = 'gaussian', ksize = (9, 9)), False, (1, 3)),
+    ('blur_median', kernel_based.blur, lambda h, w: dict(blur_type = 'median', median_ksize = 5), False, (1, 3)),
+    ('sharpen', kernel_based.sharpen, lambda h, w: dict(), False, (1, 3)),
+    ('filter_bank', FILTER_BANK, lambda h, w: dict(), False, (1, 3)),
+    ('randomErase', kernel_based.randomErase, lambda h, w: dict(size = (w // 8, h // 8)), False, (1, 3)),
+    ('randomCropAdd', kernel_based.randomCropAdd, lambda h, w: dict(size = (w // 8, h // 8)), False, (1, 3)),
+]
+
+
+BATCH_SIZES = {'64': (64, 64), '128': (128, 128), '224': (224, 224)}
+BATCH_LENGTH = 256
+NOISE_BANK = photometric.NoiseBank(size = (512, 512), channels = 3, rng = 0)
+
+# (name, minimum speedup, batched function, its arguments, single-image
+# function, arguments of image i). The minimum is None for cases expected at
+# parity, which are checked against the parity band, a number, or a dict by
+# size where sizes left out are checked against the parity band. Minimums
+# are set below the slowest of repeated runs on one core. Shared tables,
+# colorSpace and a noise bank only save the per-call overhead, which is within
+# timing noise once the crops are larger than 64x64 and the pixel work is
+# memory bound. Per-image tables are bound by the lookup itself, which leaves
+# brightness_contrast a few percent ahead of the loop.
+BATCH_CASES = [
+    ('rotate', None, batch.rotate, lambda n, h, w: dict(angle = np.linspace(-15, 15, n)),
+     geometric.rotate, lambda i, n, h, w: dict(angle = float(np.linspace(-15, 15, n)[i]))),
+    ('scale', None, batch.scale, lambda n, h, w: dict(fx = 0.5, fy = 0.5),
+     geometric.scale, lambda i, n, h, w: dict(fx = 0.5, fy = 0.5)),
+    ('shear', None, batch.shear, lambda n, h, w: dict(shear_val = 0.2),
+     geometric.shear, lambda i, n, h, w: dict(shear_val = 0.2)),
+    ('translate', None, batch.translate, lambda n, h, w: dict(tx = 5, ty = 3),
+     geometric.translate, lambda i, n, h, w: dict(tx = 5, ty = 3)),
+    ('crop', {'64': 2.0, '128': 1.3, '224': 1.0}, batch.crop, lambda n, h, w: dict(point1 = (w // 8, h // 8), point2 = (w - w // 8, h - h // 8)),
+     geometric.crop, lambda i, n, h, w: dict(point1 = (w // 8, h // 8), point2 = (w - w // 8, h - h // 8))),
+    ('random_resized_crop', None, batch.random_resized_crop, lambda n, h, w: dict(size = (w // 2, h // 2), rng = 0),
+     geometric.random_resized_crop, lambda i, n, h, w: dict(size = (w // 2, h // 2), rng = i)),
+    ('brightness_contrast', 1.0, batch.brightness_contrast, lambda n, h, w: dict(alpha = np.linspace(0.8, 1.2, n), beta = 10),
+     photometric.brightness_contrast, lambda i, n, h, w: dict(alpha = float(np.linspace(0.8, 1.2, n)[i]), beta = 10)),
+    ('brightness_contrast_shared', {'64': 1.2}, batch.brightness_contrast, lambda n, h, w: dict(alpha = 1.2, beta = 10),
+     photometric.brightness_contrast, lambda i, n, h, w: dict(alpha = 1.2, beta = 10)),
+    ('gamma', None, batch.gamma, lambda n, h, w: dict(gamma_val = np.linspace(0.5, 1.5, n)),
+     photometric.gamma, lambda i, n, h, w: dict(gamma_val = float(np.linspace(0.5, 1.5, n)[i]))),
+    ('invert', {'64': 1.2}, batch.invert, lambda n, h, w: dict(),
+     photometric.invert, lambda i, n, h, w: dict()),
+    ('posterize', {'64': 1.2}, batch.posterize, lambda n, h, w: dict(bits = 3),
+     photometric.posterize, lambda i, n, h, w: dict(bits = 3)),
+    ('colorSpace', {'64': 1.2}, batch.colorSpace, lambda n, h, w: dict(colorspace = 'hsv'),
+     photometric.colorSpace, lambda i, n, h, w: dict(colorspace = 'hsv')),
+    ('addNoise_gaussian', 1.5, batch.addNoise, lambda n, h, w: dict(var = 0.01, rng = 0),
+     photometric.addNoise, lambda i, n, h, w: dict(var = 0.01, rng = 0)),
+    ('addNoise_bank', {'64': 1.2}, batch.addNoise, lambda n, h, w: dict(var = 0.01, rng = 0, noise_bank = NOISE_BANK),
+     photometric.addNoise, lambda i, n, h, w: dict(var = 0.01, rng = 0, noise_bank = NOISE_BANK)),
+    ('randomErase', 2.0, batch.randomErase, lambda n, h, w: dict(size = (w // 4, h // 4), rng = 0),
+     kernel_based.randomErase, lambda i, n, h, w: dict(size = (w // 4, h // 4))),
+    ('randomCropAdd', 2.0, batch.randomCropAdd, lambda n, h, w: dict(size = (w // 4, h // 4), rng = 0),
+     kernel_based.randomCropAdd, lambda i, n, h, w: dict(size = (w // 4, h // 4), rng = i)),
+    ('blur_gaussian', None, batch.blur, lambda n, h, w: dict(blur_type = 'gaussian'),
+     kernel_based.blur, lambda i, n, h, w: dict(blur_type = 'gaussian')),
+    ('sharpen', None, batch.sharpen, lambda n, h, w: dict(),
+     kernel_based.sharpen, lambda i, n, h, w: dict()),
+]
+
+
+def make_image(size, channels):
+    '''Returns a real image from the bundled images resized to 'size'.'''
+
+    img = cv2.imread(os.path.join(IMAGES, '1.jpg'))
+    img = cv2.resize(img, (size[1], size[0]), interpolation = cv2.INTER_AREA)
+    if channels == 1:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    return np.ascontiguousarray(img)
+
+
+def make_boxes(size):
+    h, w = size
+    return np.array([[w * 0.1, h * 0.1, w * 0.4, h * 0.5],
+                     [w * 0.5, h * 0.3, w * 0.9, h * 0.8]])
+
+
+def measure(func, min_time = 0.2, min_runs = 3, max_runs = 200):
+    '''Returns the median seconds per call, peak traced bytes and the
+    number of allocations of one call.'''
+
+    func()
+    times = []
+    start = time.perf_counter()
+    while len(times) < max_runs and (len(times) < min_runs or time.perf_counter() - start < min_time):
+        t = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t)
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocations = sum(stat.count_diff for stat in after.compare_to(before, 'filename') if stat.count_diff > 0)
+
+    return float(np.median(times)), peak, allocations
+
+
+def run(sizes, filters = None, with_boxes = True):
+    results = {}
+    for size_name in sizes:
+        size = SIZES[size_name]
+        megapixels = size[0] * size[1] / 1e6
+
+        for channels in (1, 3):
+            img = make_image(size, channels)
+            boxes = make_boxes(size)
+
+            for name, func, kwargs, takes_box, supported in CASES:
+                if channels not in supported or (filters and not any(f in name for f in filters)):
+                    continue
+
+                variants = [('', {})]
+                if takes_box and with_boxes:
+                    variants.append(('+box', {'box': boxes}))
+
+                for suffix, extra in variants:
+                    args = dict(kwargs(*size), **extra)
+                    seconds, peak, allocations = measure(lambda: func(img, **args))
+                    key = '{}{}/{}/{}ch'.format(name, suffix, size_name, channels)
+                    results[key] = {'seconds': seconds, 'mpix_per_second': megapixels / seconds,
+                                    'peak_bytes': peak, 'allocations': allocations}
+                    print('{:<40} {:>10.3f} ms {:>10.1f} MP/s {:>10.1f} MB peak {:>6d} allocs'.format(
+                        key, seconds * 1e3, megapixels / seconds, peak / 2**20, allocations))
+    return results
+
+
+def measure_pair(func, other, rounds = 7):
+    '''Returns the fastest seconds per call of 'func' and of 'other',
+    timed alternately for 'rounds' rounds, so that changes of machine
+    load hit both alike and single slow runs are ignored.'''
+
+    seconds, other_seconds = [], []
+    for _ in range(rounds):
+        seconds.append(measure(func, min_time = 0.05)[0])
+        other_seconds.append(measure(other, min_time = 0.05)[0])
+    return min(seconds), min(other_seconds)
+
+
+def run_batch(sizes, filters = None, target = None, parity = 0.95):
+    '''Times the batched functions against a loop of the single-image
+    functions. Returns the results and the number of cases below their
+    minimum speedup - 'parity' for cases expected at parity, otherwise
+    'target' if passed or the minimum of the case.'''
+
+    results, missed = {}, 0
+    for size_name in sizes:
+        h, w = BATCH_SIZES[size_name]
+        imgs = np.stack([make_image((h, w), 3)] * BATCH_LENGTH)
+
+        for name, minimum, batch_func, batch_kwargs, func, kwargs in BATCH_CASES:
+            if filters and not any(f in name for f in filters):
+                continue
+
+            args = batch_kwargs(BATCH_LENGTH, h, w)
+            single_args = [kwargs(i, BATCH_LENGTH, h, w) for i in range(BATCH_LENGTH)]
+            # The batch is written into a reused output batch, as the batched
+            # API is meant to be used.
+            out = batch_func(imgs, **args)
+            seconds, loop_seconds = measure_pair(lambda: batch_func(imgs, out = out, **args),
+                                                 lambda: [func(img, **a) for img, a in zip(imgs, single_args)])
+
+            speedup = loop_seconds / seconds
+            if type(minimum) == dict:
+                minimum = minimum.get(size_name)
+            if minimum is None:
+                kind, minimum = 'parity', parity
+            else:
+                kind, minimum = 'faster', minimum if target is None else target
+            key = 'batch/{}/{}'.format(name, size_name)
+            results[key] = {'seconds': seconds, 'images_per_second': BATCH_LENGTH / seconds,
+                            'loop_images_per_second': BATCH_LENGTH / loop_seconds, 'speedup': speedup,
+                            'kind': kind, 'target': minimum}
+            status = 'ok' if speedup >= minimum else 'BELOW TARGET'
+            missed += speedup < minimum
+            print('{:<46} {:>10.0f} img/s {:>10.0f} img/s looped {:>6.2f}x  {:<6} >= {:.2f}x  {}'.format(
+                key, BATCH_LENGTH / seconds, BATCH_LENGTH / loop_seconds, speedup, kind, minimum, status))
+    return results, missed
+
+
+def compare(results, baseline, threshold):
+    '''Prints cases slower than the baseline by more than 'threshold'
+    and returns their number.'''
+
+    regressions = 0
+    for key, result in results.items():
+        if key not in baseline['results']:
+            continue
+        ratio = result['seconds'] / baseline['results'][key]['seconds']
+        if ratio > 1 + threshold:
+            regressions += 1
+            print('REGRESSION {:<40} {:.2f}x slower than baseline'.format(key, ratio))
+    return regressions
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__.split('\n')[0])
+    parser.add_argument('--sizes', default = None, help = 'comma separated sizes out of {} ({} with --batch)'.format(', '.join(SIZES), ', '.join(BATCH_SIZES)))
+    parser.add_argument('--filter', default = None, help = 'comma separated substrings of case names to run')
+    parser.add_argument('--no-boxes', action = 'store_false', dest = 'boxes', help = 'skip the with-box variants')
+    parser.add_argument('--save', help = 'write results to this json file')
+    parser.add_argument('--compare', help = 'baseline json file to compare against')
+    parser.add_argument('--threshold', type = float, default = 0.2, help = 'allowed slowdown before failing (default 0.2)')
+    parser.add_argument('--batch', action = 'store_true', help = 'benchmark the batched functions on small crops')
+    parser.add_argument('--batch-target', type = float, default = None, help = 'minimum speedup of every vectorized batched function over the per-image loop (default: the target of each case)')
+    parser.add_argument('--parity-band', type = float, default = 0.95, help = 'minimum speedup of batched warps and filters, expected at parity (default 0.95)')
+    args = parser.parse_args(argv)
+
+    known = BATCH_SIZES if args.batch else SIZES
+    sizes = args.sizes.split(',') if args.sizes else list(known)
+    for size in sizes:
+        if size not in known:
+            parser.error("Unknown size '{}'.".format(size))
+    filters = args.filter.split(',') if args.filter else None
+
+    missed = 0
+    if args.batch:
+        results, missed = run_batch(sizes, filters, args.batch_target, args.parity_band)
+    else:
+        results = run(sizes, filters, args.boxes)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'python': platform.python_version(), 'numpy': np.__version__, 'opencv': cv2.__version__,
+                       'machine': platform.machine(), 'results': results}, f, indent = 1)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print('{} regression(s) above {:.0%}.'.format(regressions, args.threshold))
+            return 1
+        print('No regressions above {:.0%}.'.format(args.threshold))
+
+    if missed:
+        print('{} batched case(s) below their minimum speedup.'.format(missed))
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -21,5 +21,6 @@ setuptools.setup(
     ],
     python_requires='>=3.6',
     keywords='augment, augmentation, image, object, sampling',
-    install_requires = ['opencv-python>=4.1.1', 'numpy>=1.19.0']
+    install_requires = ['opencv-python>=4.1.1', 'numpy>=1.19.0'],
+    entry_points = {'console_scripts': ['augment-auto=augment.cli:main']}
 )
@@ -0,0 +1,57 @@
+'''Checks the batched functions against the single-image functions.'''
+
+import numpy as np
+import pytest
+
+from augment import batch, geometric, kernel_based, photometric
+
+
+N = 4
+
+# (batched function, its arguments, single-image function, arguments of image i)
+CASES = [
+    (batch.crop, dict(point1 = (5, 3), point2 = (40, 30)), geometric.crop, lambda i: dict(point1 = (5, 3), point2 = (40, 30))),
+    (batch.brightness_contrast, dict(alpha = np.linspace(0.5, 2, N), beta = -5), photometric.brightness_contrast, lambda i: dict(alpha = float(np.linspace(0.5, 2, N)[i]), beta = -5)),
+    (batch.brightness_contrast, dict(alpha = 1.3, beta = 7), photometric.brightness_contrast, lambda i: dict(alpha = 1.3, beta = 7)),
+    (batch.gamma, dict(gamma_val = np.linspace(0.5, 2, N)), photometric.gamma, lambda i: dict(gamma_val = float(np.linspace(0.5, 2, N)[i]))),
+    (batch.invert, dict(), photometric.invert, lambda i: dict()),
+    (batch.posterize, dict(bits = np.array([1, 3, 5, 8])), photometric.posterize, lambda i: dict(bits = [1, 3, 5, 8][i])),
+    (batch.colorSpace, dict(colorspace = 'lab'), photometric.colorSpace, lambda i: dict(colorspace = 'lab')),
+    (batch.sharpen, dict(), kernel_based.sharpen, lambda i: dict()),
+]
+
+
+@pytest.fixture(scope = 'module')
+def imgs():
+    return np.random.default_rng(0).integers(0, 256, (N, 36, 48, 3), dtype = np.uint8)
+
+
+@pytest.mark.parametrize('batch_func, batch_kwargs, func, kwargs', CASES, ids = lambda case: getattr(case, '__name__', ''))
+def test_same_as_single(imgs, batch_func, batch_kwargs, func, kwargs):
+    result = batch_func(imgs, **batch_kwargs)
+
+    for i in range(N):
+        assert np.array_equal(result[i], func(imgs[i], **kwargs(i)))
+
+    out = np.empty_like(result)
+    assert batch_func(imgs, out = out, **batch_kwargs) is out
+    assert np.array_equal(out, result)
+
+
+def test_random_ops_many_channels():
+    imgs = np.random.default_rng(0).integers(0, 256, (N, 36, 48, 6), dtype = np.uint8)
+
+    result = batch.randomErase(imgs, (8, 8), rng = 0)
+    assert result.shape == imgs.shape
+
+    result = batch.randomCropAdd(imgs, (8, 8), rng = 0)
+    assert np.array_equal(result, batch.randomCropAdd(imgs, (8, 8), rng = 0))
+
+
+def test_random_resized_crop_boxes(imgs):
+    boxes, offsets = batch.pack_boxes([np.array([[5, 5, 40, 30]]), np.zeros((0, 4)), np.array([[0, 0, 47, 35], [10, 10, 20, 20]]), np.array([[1, 1, 30, 30]])])
+    result, boxes_new, degenerate = batch.random_resized_crop(imgs, (32, 24), boxes = boxes, offsets = offsets, rng = 0)
+
+    assert result.shape == (N, 24, 32, 3)
+    assert boxes_new.shape == boxes.shape and degenerate.shape == (len(boxes),)
+    assert np.array_equal(result, batch.random_resized_crop(imgs, (32, 24), rng = 0))
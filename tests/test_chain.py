@@ -0,0 +1,28 @@
+'''Checks parsing and applying chains of operations.'''
+
+import numpy as np
+import pytest
+
+from augment import chain
+
+
+def test_parse_op():
+    assert chain.parse_op("blur('gaussian', ksize = (9, 9))") == ('blur', ('gaussian',), {'ksize': (9, 9)})
+
+
+@pytest.mark.parametrize('spec', ['set_remap_cache(None)', 'get_remap_cache()', 'unknown(1)'])
+def test_parse_op_rejects_non_image_functions(spec):
+    with pytest.raises(ValueError):
+        chain.parse_op(spec)
+
+
+def test_apply_ops_keeps_degenerate_boxes():
+    img = np.zeros((100, 200, 3), dtype = np.uint8)
+    boxes = np.array([[10, 10, 50, 50], [150, 60, 190, 90], [60, 20, 100, 40]], dtype = np.float64)
+    ops = [chain.parse_op('crop((0, 0), (120, 99))'), chain.parse_op('rotate(angle = 10)')]
+
+    img_new, boxes_new = chain.apply_ops(img, boxes, ops)
+
+    assert len(boxes_new) == len(boxes)
+    assert np.array_equal(boxes_new[1], [0, 0, 0, 0])
+    assert not np.array_equal(boxes_new[0], [0, 0, 0, 0]) and not np.array_equal(boxes_new[2], [0, 0, 0, 0])
@@ -0,0 +1,37 @@
+'''Checks the region arguments of randomErase and randomCropAdd.'''
+
+import numpy as np
+import pytest
+
+from augment import kernel_based
+
+
+def test_random_erase_many_channels():
+    img = np.random.default_rng(0).integers(0, 256, (60, 80, 6), dtype = np.uint8)
+    rects = np.array([[10, 5, 30, 25]])
+
+    result = kernel_based.randomErase(img, None, rects = rects)
+    assert np.all(result[5:25, 10:30] == int(img.mean()))
+
+    result = kernel_based.randomErase(img, None, rects = rects, per_channel = True)
+    assert np.array_equal(result[5, 10], img.reshape(-1, 6).mean(axis = 0).astype(np.uint8))
+
+
+def test_random_crop_add_rects():
+    img = np.random.default_rng(0).integers(0, 256, (60, 80, 3), dtype = np.uint8)
+    rects = np.array([[0, 0, 10, 20], [50, 30, 80, 60]])
+
+    result = kernel_based.randomCropAdd(img, None, rects = rects, rng = 0)
+    assert np.array_equal(result[20:30, 10:50], img[20:30, 10:50])
+    assert np.array_equal(result, kernel_based.randomCropAdd(img, None, rects = rects, rng = 0))
+
+
+@pytest.mark.parametrize('func', [kernel_based.randomErase, kernel_based.randomCropAdd])
+def test_rects_with_box_or_count(func):
+    img = np.zeros((60, 80, 3), dtype = np.uint8)
+    rects = np.array([[0, 0, 10, 10]])
+
+    with pytest.raises(AssertionError):
+        func(img, (10, 10), box = [0, 0, 40, 30], rects = rects)
+    with pytest.raises(AssertionError):
+        func(img, (10, 10), count = 3, rects = rects)
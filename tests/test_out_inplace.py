@@ -0,0 +1,114 @@
+'''Checks the 'out' and 'inplace' arguments of every augmentation function -
+the passed image is left unchanged unless inplace is requested, and 'out'
+and inplace give the same result as a normal call.'''
+
+import inspect
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from augment import geometric, kernel_based, photometric
+
+
+IMAGE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'images', '1.jpg')
+
+# Arguments of every function. Random functions get a fixed seed, so
+# repeated calls give the same result.
+CASES = {
+    'crop': [dict(point1 = (10, 20), point2 = (150, 110))],
+    'rotate': [dict(angle = 15), dict(angle = 15, keep_resolution = False)],
+    'scale': [dict(fx = 0.5, fy = 0.5), dict(fx = 1.5, fy = 1.5, keep_resolution = True)],
+    'shear': [dict(shear_val = 0.2), dict(shear_val = 0.2, axis = 1)],
+    'translate': [dict(tx = 20, ty = -10)],
+    'random_resized_crop': [dict(size = (64, 48), rng = 0)],
+    'brightness_contrast': [dict(alpha = 1.3, beta = 20)],
+    'gamma': [dict(gamma_val = 0.8)],
+    'invert': [dict()],
+    'posterize': [dict(bits = 3)],
+    'colorSpace': [dict(colorspace = 'hsv'), dict(colorspace = 'lab')],
+    'color_jitter': [dict(hue = 10, saturation = 1.3, value = 0.9)],
+    'addNoise': [dict(noise_type = 'gaussian', rng = 0), dict(noise_type = 'salt_pepper', rng = 0), dict(noise_type = 'poisson', rng = 0)],
+    'blur': [dict(blur_type = 'avg', ksize = (5, 5)), dict(blur_type = 'gaussian', ksize = (9, 9)), dict(blur_type = 'median', median_ksize = 5)],
+    'sharpen': [dict()],
+    'randomErase': [dict(size = (30, 20), count = 5, rng = 0)],
+    'randomCropAdd': [dict(size = (30, 20), count = 5, rng = 0), dict(size = (60, 60), count = 20, rng = 3)],
+}
+
+
+def _functions():
+    '''Returns all public image functions of the augmentation modules.'''
+
+    functions = {}
+    for module in (geometric, photometric, kernel_based):
+        for name, func in inspect.getmembers(module, inspect.isfunction):
+            if not name.startswith('_') and func.__module__ == module.__name__ and 'img' in inspect.signature(func).parameters:
+                functions[name] = func
+    return functions
+
+
+FUNCTIONS = _functions()
+PARAMS = [pytest.param(name, kwargs, id = '{}-{}'.format(name, i)) for name in sorted(CASES) for i, kwargs in enumerate(CASES[name])]
+
+
+@pytest.fixture(scope = 'module')
+def image():
+    img = cv2.imread(IMAGE)
+    return np.ascontiguousarray(cv2.resize(img, (200, 150), interpolation = cv2.INTER_AREA))
+
+
+def test_every_function_is_covered():
+    assert sorted(FUNCTIONS) == sorted(CASES)
+
+
+@pytest.mark.parametrize('name, kwargs', PARAMS)
+def test_input_unchanged(image, name, kwargs):
+    img = image.copy()
+    result = FUNCTIONS[name](img, **kwargs)
+
+    assert np.array_equal(img, image)
+    assert not np.shares_memory(result, img)
+
+
+@pytest.mark.parametrize('name, kwargs', PARAMS)
+def test_out(image, name, kwargs):
+    func = FUNCTIONS[name]
+    expected = func(image.copy(), **kwargs)
+
+    img = image.copy()
+    out = np.empty_like(expected)
+    result = func(img, out = out, **kwargs)
+
+    assert result is out
+    assert np.array_equal(out, expected)
+    assert np.array_equal(img, image)
+
+
+@pytest.mark.parametrize('name, kwargs', PARAMS)
+def test_inplace(image, name, kwargs):
+    func = FUNCTIONS[name]
+    expected = func(image.copy(), **kwargs)
+    if 'inplace' not in inspect.signature(func).parameters or expected.shape != image.shape:
+        pytest.skip('output can not be written into the input')
+
+    img = image.copy()
+    result = func(img, inplace = True, **kwargs)
+
+    assert result is img
+    assert np.array_equal(img, expected)
+
+
+@pytest.mark.parametrize('name, kwargs', PARAMS)
+def test_inplace_strided_view(image, name, kwargs):
+    func = FUNCTIONS[name]
+    if 'inplace' not in inspect.signature(func).parameters:
+        pytest.skip('function has no inplace argument')
+
+    with pytest.raises(AssertionError):
+        func(image.copy()[:, ::2], inplace = True, **kwargs)
+
+
+def test_out_and_inplace_together(image):
+    with pytest.raises(AssertionError):
+        photometric.invert(image.copy(), out = np.empty_like(image), inplace = True)
@@ -0,0 +1,18 @@
+'''Checks tiled processing against the whole-image functions.'''
+
+import numpy as np
+
+from augment import tiled
+
+
+def test_salt_pepper_hits_tile_seams():
+    img = np.full((512, 512, 3), 128, dtype = np.uint8)
+    result = tiled.apply_tiled(img, 'addNoise', tile_size = (128, 128), noise_type = 'salt_pepper', noise_amount = 0.5, rng = 0)
+
+    changed = (result != img).any(axis = 2)
+    seams = np.zeros(changed.shape, dtype = bool)
+    seams[127::128] = True
+    seams[:, 127::128] = True
+
+    # The last row and column of every tile are hit as often as the rest.
+    assert abs(changed[seams].mean() - changed[~seams].mean()) < 0.05